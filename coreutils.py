@@ -10,8 +10,55 @@ also enables the consumption of record streams originating from
 other modules or sources.
 """
 
+import csv
+import functools
+import io
+import multiprocessing
+import operator
 import re
 import sys
+import weakref
+from collections import Counter, OrderedDict, deque
+from itertools import chain, count, groupby, islice, starmap
+
+try:
+    # Python 2: use the lazy versions so chainables can return them from __iter__()
+    from itertools import ifilter as filter, imap as map, izip as zip
+except ImportError:
+    pass
+
+# concurrent.futures needs the 'futures' backport on Python 2; it is only
+# needed by run_parallel()
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# re2 and hyperscan are optional regular expression engines for grep()
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# pyarrow is optional; it is only needed for the columnar readers and batches,
+# and is imported by _import_pyarrow() the first time it is, since importing it
+# takes several times longer than importing this module
+
+pa = None
+pc = None
+pacsv = None
 
 
 # verbose is used to cleanly enable or silence all .count(), .show()
@@ -47,9 +94,285 @@ def get_zero_based():
     return _zero_based
 
 
+def field_index(field):
+    """Returns the zero-based position of a field number given the zero_based setting."""
+    global _zero_based
+    return field if _zero_based else field - 1
+
+
 def flatten(list_of_lists):
     """Return a list-of-lists into a single list with only items in it."""
-    return [item for inner_list in list_of_lists for item in inner_list]
+    return list(chain.from_iterable(list_of_lists))
+
+
+def iflatten(list_of_lists):
+    """Like flatten(), but returns an iterator over the items instead of a list."""
+    return chain.from_iterable(list_of_lists)
+
+
+# compiled regular expressions used by grep(), so that building the same
+# pipeline many times only compiles its patterns once
+
+_search_cache = {}
+_search_cache_size = 512
+
+
+def compiled_search(regex, flags=0, engine='re'):
+    """
+    Returns a search function for the regex, reusing earlier compilations.
+
+    :param regex:  The regular expression.
+    :param flags:  re module flags.  The re2 and hyperscan engines support
+                   re.IGNORECASE, re.MULTILINE and re.DOTALL.
+    :param engine: 're' (the default) for the standard library, 're2' for
+                   Google RE2 (requires google-re2) or 'hyperscan' for Intel
+                   Hyperscan (requires hyperscan).  Both of the latter match
+                   in linear time but don't support backreferences or
+                   lookaround assertions.  'auto' picks hyperscan, then re2,
+                   whichever is installed, for regular expressions without
+                   flags that all engines read the same way (literals,
+                   escaped punctuation, ., ^, quantifiers, groups,
+                   alternation and simple character classes), and re for the
+                   rest, so it finds the same records as 're'.
+                   Consecutive hyperscan greps in a chain scan each record
+                   once with a single database.
+    :return:       A function that returns a true value for the records that
+                   the regex matches.
+    """
+    key = (type(regex), regex, flags, engine)
+    search = _search_cache.get(key)
+
+    if search is None:
+        if engine not in _regex_engines:
+            raise RuntimeError("unknown regex engine '{}'".format(engine))
+
+        if len(_search_cache) >= _search_cache_size:
+            _search_cache.clear()
+
+        search = _search_cache[key] = _regex_engines[engine](regex, flags)
+
+    return search
+
+
+def _inline_flags(flags):
+    """Returns the re flags as the letters of an inline flag group like (?im)."""
+    letters = {re.IGNORECASE: 'i', re.MULTILINE: 'm', re.DOTALL: 's'}
+
+    if flags & ~sum(letters):
+        raise RuntimeError('only re.IGNORECASE, re.MULTILINE and re.DOTALL are supported by this engine')
+
+    return ''.join(letters[f] for f in letters if flags & f)
+
+
+def _re_search(regex, flags):
+    """Returns the search method of a regex compiled by the re module."""
+    return re.compile(regex, flags).search
+
+
+def _re2_search(regex, flags):
+    """Returns the search method of a regex compiled by RE2."""
+    if re2 is None:
+        raise ImportError("the 're2' engine requires google-re2")
+
+    letters = _inline_flags(flags)
+
+    if letters:
+        prefix = '(?{})'.format(letters)
+
+        # a bytes regex needs a bytes prefix, or formatting it in would give '(?i)b'...''
+        regex = (prefix.encode('ascii') if isinstance(regex, bytes) else prefix) + regex
+
+    return re2.compile(regex).search
+
+
+def _hyperscan_match(expression_id, start, end, flags, context):
+    """Hyperscan match handler that records the match in the context list."""
+    context.append(expression_id)
+
+
+def _hyperscan_search(regex, flags):
+    """Returns a search function that scans each record with a Hyperscan database."""
+    if hyperscan is None:
+        raise ImportError("the 'hyperscan' engine requires hyperscan")
+
+    letters = _inline_flags(flags)
+    hs_flags = hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_ALLOWEMPTY
+    hs_flags |= hyperscan.HS_FLAG_CASELESS if 'i' in letters else 0
+    hs_flags |= hyperscan.HS_FLAG_MULTILINE if 'm' in letters else 0
+    hs_flags |= hyperscan.HS_FLAG_DOTALL if 's' in letters else 0
+    text = not isinstance(regex, bytes)
+
+    if text:
+        # match str records by their characters, like the re module does
+        regex = regex.encode('utf-8')
+        hs_flags |= hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+
+    return _hyperscan_all(((regex, hs_flags),), text)
+
+
+def _hyperscan_all(expressions, text):
+    """
+    Returns a search function that scans each record once with a Hyperscan database
+    of all the (regex, hyperscan flags) expressions, and returns True for the records
+    that every one of them matches.  The function keeps the expressions in its
+    hyperscan attribute so that _fuse_greps() can combine it with others.
+    """
+    key = ('hyperscan', expressions, text)
+    search = _search_cache.get(key)
+
+    if search is not None:
+        return search
+
+    db = hyperscan.Database()
+    db.compile(expressions=[regex for regex, hs_flags in expressions], ids=list(range(len(expressions))),
+               flags=[hs_flags for regex, hs_flags in expressions])
+    wanted = len(expressions)
+
+    # each expression reports at most one match, so a record matching all of them
+    # reports as many matches as there are expressions
+    def search(rec):
+        matches = []
+        db.scan(rec.encode('utf-8') if text else rec, match_event_handler=_hyperscan_match, context=matches)
+        return len(matches) == wanted
+
+    search.hyperscan = expressions, text
+
+    if len(_search_cache) >= _search_cache_size:
+        _search_cache.clear()
+
+    _search_cache[key] = search
+
+    return search
+
+
+def _fuse_greps(stages):
+    """Combines consecutive filter stages from hyperscan greps of the same kind of
+    record (str or bytes) into a single filter stage."""
+    fused = []
+
+    for kind, item in stages:
+        previous = fused and fused[-1][0] == 'filter' and getattr(fused[-1][1], 'hyperscan', None)
+        current = kind == 'filter' and getattr(item, 'hyperscan', None)
+
+        if previous and current and previous[1] == current[1]:
+            fused[-1] = 'filter', _hyperscan_all(previous[0] + current[0], current[1])
+        else:
+            fused.append((kind, item))
+
+    return fused
+
+
+# regular expressions that every engine reads the same way: ASCII literals,
+# escaped punctuation, ., ^, the quantifiers *, +, ? and {m}, {m,} or {m,n}, plain
+# groups, alternation and simple character classes.  $ is left out because re
+# also matches it before a final newline and re2 doesn't, as is \d, \w and the
+# like, whose Unicode meaning differs between the engines
+
+_portable_regex = re.compile(r"""
+    (?: [A-Za-z0-9 _,;:!@#%&=~'"<>/-]
+      | \\[^A-Za-z0-9]
+      | [.^*+?|)]
+      | \((?!\?)
+      | \[\^?(?:[A-Za-z0-9 _](?:-[A-Za-z0-9])?)+\]
+      | \{[0-9]+(?:,[0-9]*)?\}
+    )*\Z""", re.VERBOSE)
+
+# a quantifier after another, e.g. a possessive *+, which the engines treat differently
+_stacked_quantifiers = re.compile(r'(?<!\\)[*+?}][*+{]')
+
+
+def _portable(regex, flags):
+    """Returns True if every engine finds the same records for the regex."""
+    if flags:
+        return False
+
+    if isinstance(regex, bytes):
+        regex = regex.decode('latin-1')
+
+    return bool(_portable_regex.match(regex)) and not _stacked_quantifiers.search(regex)
+
+
+def _auto_search(regex, flags):
+    """Returns the search function of the first engine that is installed and can
+    compile the regex, trying hyperscan, then re2, then re.  Only regular
+    expressions without flags that _portable() accepts go to the first two, so
+    that the records found never depend on the packages installed."""
+    search = _re_search(regex, flags)
+
+    if not _portable(regex, flags):
+        return search
+
+    for engine, module in (('hyperscan', hyperscan), ('re2', re2)):
+        if module is not None:
+            try:
+                return _regex_engines[engine](regex, flags)
+            except Exception:
+                # e.g. a limit of the engine on the size of the regex
+                pass
+
+    return search
+
+
+# dicts keep their keys in insertion order from Python 3.7; before that,
+# HashReduceChainable needs ordered versions to output keys in the order seen
+
+if sys.version_info >= (3, 7):
+    _OrderedCounter = Counter
+    _ordered_dict = dict
+else:
+    class _OrderedCounter(Counter, OrderedDict):
+        """Counter that remembers the order its keys were first counted in."""
+
+    _ordered_dict = OrderedDict
+
+
+_regex_engines = {'re': _re_search, 're2': _re2_search, 'hyperscan': _hyperscan_search, 'auto': _auto_search}
+
+
+def batch_rows(batch):
+    """Returns an iterator of records (lists of fields) from a columnar record batch,
+    either a pyarrow RecordBatch or a NumPy structured array."""
+    if _is_structured(batch):
+        return map(list, batch.tolist())
+
+    return map(list, zip(*[column.to_pylist() for column in batch.columns]))
+
+
+def _import_pyarrow():
+    """Imports pyarrow, pyarrow.compute and pyarrow.csv as pa, pc and pacsv the first
+    time they are needed.  Returns False if pyarrow isn't installed."""
+    global pa, pc, pacsv
+
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.csv
+        except ImportError:
+            return False
+
+        pa, pc, pacsv = pyarrow, pyarrow.compute, pyarrow.csv
+
+    return True
+
+
+def _is_arrow(value):
+    """Returns True if value is a pyarrow Array.  pyarrow has been imported by whoever
+    made one, so this only imports it here when it is already loaded."""
+    return 'pyarrow' in sys.modules and _import_pyarrow() and isinstance(value, pa.Array)
+
+
+def _is_structured(batch):
+    """Returns True if batch is a NumPy structured array, with one named field per column."""
+    return np is not None and isinstance(batch, np.ndarray) and batch.dtype.names is not None
+
+
+def _batch_column(batch, index):
+    """Returns the column at a zero-based position of a pyarrow batch or NumPy structured array."""
+    if _is_structured(batch):
+        return batch[batch.dtype.names[index]]
+
+    return batch.column(index)
 
 
 def writeln(msg):
@@ -78,6 +401,29 @@ class Cond(object):
         self.op = op
         self.value = value
 
+    def __setattr__(self, name, value):
+        # changing the condition discards the function memoized by __call__()
+        object.__setattr__(self, name, value)
+
+        if name != '_func':
+            object.__setattr__(self, '_func', None)
+
+    def inlinable(self):
+        """Returns True if the condition can be compiled into generated code, alone
+        or together with other conditions."""
+        return self.reads_field() and self.op in _op_symbols
+
+    def reads_field(self):
+        """Returns True if the condition tests a field number with the
+        get_value_func() and __call__() of Cond, so that the field can be read
+        directly rather than through a call to get_value_func(), and the test
+        needn't go through the function from __call__()."""
+        get_value_func = type(self).get_value_func
+        call = type(self).__call__
+
+        return (isinstance(self.field, int) and getattr(get_value_func, '__func__', get_value_func) is _get_value_func
+                and getattr(call, '__func__', call) is _cond_call)
+
     def get_value_func(self, item):
         """
         Returns a function that when supplied a record will return a
@@ -112,46 +458,97 @@ class Cond(object):
         return func
 
     def __call__(self):
-        """Returns a function that takes the entire record and evaluates the configured condition."""
-        func1 = self.get_value_func(self.field)
+        """Returns a function that takes the entire record and evaluates the configured condition.
 
-        def func(rec):
-            return self.op(func1(rec), self.value)
+        The field, operator and value are bound when the function is created,
+        so later changes to the instance do not affect functions already obtained.
+        The function is memoized until the instance or the zero_based setting change.
+        A function testing is_in against a list isn't memoized, since it tests
+        against a copy of the list, which would miss later changes to the list.
+        """
+        global _zero_based
 
-        return func
+        if self.op is is_in and isinstance(self.value, list):
+            return self._build_func()
 
-    def __repr__(self):
-        return 'Cond({}, {}, {})'.format(self.field, self.op.__name__, self.value)
+        if self._func is None or self._func[0] != _zero_based:
+            self._func = (_zero_based, self._build_func())
 
+        return self._func[1]
 
-def eq(a, b):
-    """Evaluate whether a equals b."""
-    return a == b
+    def _build_func(self):
+        """Returns a new function that evaluates the configured condition."""
+        if not self.reads_field():
+            def func(rec, _value_func=self.get_value_func(self.field), _op=self.op, _value=self.value):
+                return _op(_value_func(rec), _value)
 
+            return func
 
-def ne(a, b):
-    """Evaluate whether a does not equal b."""
-    return a != b
+        index = field_index(self.field)
 
+        # the built-in comparisons are compiled into a function with the field
+        # index and the operator inlined, e.g. 'return result > _value'
+        if self.inlinable():
+            return _compile_conds([self])
 
-def gt(a, b):
-    """Evaluate whether a is greater than b."""
-    return a > b
+        # bind everything as defaults so the per-record call only does fast local lookups
+        def func(rec, _index=index, _op=self.op, _value=self.value):
+            result = rec[_index]
 
+            if result is None:
+                raise RuntimeError('Attempt to return None from rec {}'.format(rec))
 
-def gte(a, b):
-    """Evaluate whether a is greater than or equal to b."""
-    return a >= b
+            return _op(result, _value)
 
+        return func
 
-def lt(a, b):
-    """Evaluate whether a is less than b."""
-    return a < b
+    def compile_mask(self, column):
+        """
+        Evaluates the condition over an entire column at once.
+
+        The vectorized NumPy or pyarrow.compute operators are used; numeric
+        pyarrow columns without nulls are compared as NumPy arrays.  Null
+        values in pyarrow columns never match.  Only values of
+        the column's own kind are vectorized: ints for int columns, floats for
+        float columns and str for string columns.
+
+        :param column: A NumPy array or pyarrow Array holding the values of
+                       the field this condition tests.
+        :return:       A boolean NumPy array or pyarrow BooleanArray, or None
+                       if the operator or value can't be vectorized, in which
+                       case the caller should evaluate record by record.
+        """
+        if _is_arrow(column):
+            if np is not None and column.null_count == 0 and \
+                    (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)):
+                return self.compile_mask(column.to_numpy())
 
+            return _arrow_mask(column, self.op, self.value)
 
-def lte(a, b):
-    """Evaluate whether a is less than or equal to b."""
-    return a <= b
+        if np is not None and isinstance(column, np.ndarray):
+            return _numpy_mask(column, self.op, self.value)
+
+        return None
+
+    def __repr__(self):
+        return 'Cond({}, {}, {})'.format(self.field, _op_names.get(self.op, self.op.__name__), self.value)
+
+
+# the get_value_func() and __call__() of Cond itself, which subclasses that don't
+# override them inherit
+_get_value_func = getattr(Cond.get_value_func, '__func__', Cond.get_value_func)
+_cond_call = getattr(Cond.__call__, '__func__', Cond.__call__)
+
+
+# the comparison operators are the C functions of the operator module, which
+# saves a Python frame per comparison wherever they are called directly
+
+eq = operator.eq
+ne = operator.ne
+gt = operator.gt
+gte = operator.ge
+lt = operator.lt
+lte = operator.le
 
 
 # would have preferred to name this 'in', but that is a reserved word
@@ -160,51 +557,605 @@ def is_in(a, b):
     return a in b
 
 
+# names shown by Cond.__repr__() where they differ from the function's __name__
+_op_names = {gte: 'gte', lte: 'lte'}
+
+
+# Cond and Key generate Python source for their functions; compiled code is
+# cached by source, which only depends on the shape (field indices, operator
+# and number of casts), while values and casts are bound as default arguments
+
+_op_symbols = {eq: '==', ne: '!=', gt: '>', gte: '>=', lt: '<', lte: '<=', is_in: 'in'}
+
+_KEY_TEMPLATE = """
+def key(rec{params}):
+    return [{terms}]
+"""
+
+_code_cache = {}
+_code_cache_size = 512
+
+
+def _compile_function(name, source, namespace):
+    """Returns the function called name that source defines, with namespace as its
+    globals.  The source is only compiled the first time it is seen."""
+    code = _code_cache.get(source)
+
+    if code is None:
+        if len(_code_cache) >= _code_cache_size:
+            _code_cache.clear()
+
+        code = _code_cache[source] = compile(source, '<coreutils {}>'.format(name), 'exec')
+
+    exec(code, namespace)
+
+    return namespace[name]
+
+
+def _compile_conds(conds, scan=False):
+    """
+    Returns a single function that is True for a record when all of the inlinable
+    Cond instances are, evaluating them in order and stopping at the first that is
+    False, e.g. for two conditions:
+
+        def cond(rec, _value0=_value0, _value1=_value1):
+            result = rec[3]
+
+            if result is None:
+                _none_error(rec)
+
+            if not result > _value0:
+                return False
+
+            result = rec[1]
+            ...
+            return result == _value1
+
+    With scan=True, the function is instead a generator that takes an iterator of
+    records and yields those passing all conditions, with the same tests inlined
+    into its loop ('continue' instead of 'return False'), so there is no function
+    call per record at all.
+    """
+    namespace = {'_none_error': _none_error}
+    indent = '        ' if scan else '    '
+    params = []
+    lines = []
+
+    for n, c in enumerate(conds):
+        value = '_value{}'.format(n)
+        namespace[value] = _haystack(c.value) if c.op is is_in else c.value
+        params.append(', {0}={0}'.format(value))
+
+        lines.append('{0}result = rec[{1}]\n\n{0}if result is None:\n{0}    _none_error(rec)\n'.format(
+            indent, int(field_index(c.field))))
+        test = 'result {} {}'.format(_op_symbols[c.op], value)
+
+        # a field value that can't be hashed, e.g. a list, is looked for in the
+        # original list or tuple rather than the frozenset
+        if namespace[value] is not c.value:
+            items = '_items{}'.format(n)
+            namespace[items] = c.value
+            params.append(', {0}={0}'.format(items))
+            lines.append('{0}try:\n{0}    found = {1}\n{0}except TypeError:\n{0}    found = result in {2}\n'.format(
+                indent, test, items))
+            test = 'found'
+
+        if scan:
+            lines.append('{0}if not {1}:\n{0}    continue\n'.format(indent, test))
+        elif n < len(conds) - 1:
+            lines.append('{0}if not {1}:\n{0}    return False\n'.format(indent, test))
+        else:
+            lines.append('{0}return {1}\n'.format(indent, test))
+
+    if scan:
+        lines.append('{}yield rec\n'.format(indent))
+        source = 'def scan(records{}):\n    for rec in records:\n{}'.format(''.join(params), '\n'.join(lines))
+    else:
+        source = 'def cond(rec{}):\n{}'.format(''.join(params), '\n'.join(lines))
+
+    return _compile_function('scan' if scan else 'cond', source, namespace)
+
+
+def _haystack(value):
+    """Returns a list or tuple of hashable values as a frozenset, so that testing
+    membership is a hash lookup rather than a scan, or else value unchanged;
+    str in particular keeps its substring semantics.  The generated tests look
+    for field values that can't be hashed in value itself."""
+    if isinstance(value, (list, tuple)):
+        try:
+            return frozenset(value)
+        except TypeError:
+            pass
+
+    return value
+
+
+def _contradictory(conds):
+    """
+    Returns True if no record can pass all of the conditions because two of them
+    test the same field for equality with different values, or for equality with
+    a value that isn't among the values of an is_in.  Only values that are all
+    str or all numbers are compared, since then no field value can be equal to
+    two different ones.
+    """
+    def kind(value):
+        return 'str' if _is_str(value) else 'number' if _is_number(value) else None
+
+    eqs = {}
+
+    for c in conds:
+        if c.op is eq and kind(c.value) is not None:
+            if any(kind(v) == kind(c.value) and v != c.value for v in eqs.get(c.field, [])):
+                return True
+
+            eqs.setdefault(c.field, []).append(c.value)
+
+    for c in conds:
+        if c.op is is_in and isinstance(c.value, (list, tuple, set, frozenset)):
+            for value in eqs.get(c.field, []):
+                if all(kind(v) == kind(value) for v in c.value) and value not in c.value:
+                    return True
+
+    return False
+
+
+def _none_error(rec):
+    """Raises the error for a record whose field is None."""
+    raise RuntimeError('Attempt to return None from rec {}'.format(rec))
+
+
+# vectorized equivalents of the operator functions, used by Cond.compile_mask()
+
+if np is not None:
+    _numpy_ops = {
+        eq: np.equal, ne: np.not_equal, gt: np.greater, gte: np.greater_equal, lt: np.less, lte: np.less_equal
+    }
+else:
+    _numpy_ops = {}
+
+# the names of the pyarrow.compute functions, looked up once pyarrow is imported
+_arrow_ops = {eq: 'equal', ne: 'not_equal', gt: 'greater', gte: 'greater_equal', lt: 'less', lte: 'less_equal'}
+
+
+def _is_number(value):
+    """Returns whether value is an int or float that NumPy can compare without conversion."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_str(value):
+    """Returns whether value is a str."""
+    return isinstance(value, str)
+
+
+def _same_kind(kind, value):
+    """
+    Returns True if value is of the kind of a column, given as a NumPy dtype kind:
+    an int for 'i' and 'u', a float for 'f' and a str for 'U'.  Columns are only
+    compared with values of their own kind, since an int column compared with a
+    float (or a float column with an int) is converted to float64 first, which
+    loses precision above 2**53 where Python compares exactly.
+    """
+    if kind in 'iu':
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    if kind == 'f':
+        return isinstance(value, float)
+
+    return kind == 'U' and _is_str(value)
+
+
+def _numpy_mask(column, op, value):
+    """Returns a boolean mask for op(column, value) on a NumPy column, or None."""
+    kind = column.dtype.kind
+
+    # only vectorize when NumPy compares exactly like Python does, otherwise
+    # NumPy would silently convert types
+    if op is is_in:
+        if isinstance(value, str) or not all(_same_kind(kind, v) and _fits(column, v) for v in value):
+            return None
+
+        return np.isin(column, list(value))
+
+    if op not in _numpy_ops or not _same_kind(kind, value) or not _fits(column, value):
+        return None
+
+    return _numpy_ops[op](column, value)
+
+
+def _fits(column, value):
+    """Returns False for an int that doesn't fit the type of an int NumPy column,
+    which NumPy would compare after converting; such values are compared record
+    by record instead."""
+    if column.dtype.kind not in 'iu':
+        return True
+
+    info = np.iinfo(column.dtype)
+
+    return info.min <= value <= info.max
+
+
+def _arrow_mask(column, op, value):
+    """Returns a boolean mask for op(column, value) on a pyarrow column, or None."""
+    if pa.types.is_integer(column.type):
+        kind = 'i'
+    elif pa.types.is_floating(column.type):
+        kind = 'f'
+    elif pa.types.is_string(column.type):
+        kind = 'U'
+    else:
+        return None
+
+    # like NumPy, pyarrow converts values of another kind than the column's
+    values = value if op is is_in and not isinstance(value, str) else [value]
+
+    if not all(_same_kind(kind, v) for v in values):
+        return None
+
+    try:
+        if op is is_in:
+            if isinstance(value, str):
+                return None
+
+            return pc.is_in(column, value_set=pa.array(list(value)))
+
+        if op in _arrow_ops:
+            return getattr(pc, _arrow_ops[op])(column, value)
+    except (TypeError, ValueError, NotImplementedError, OverflowError):
+        # pyarrow refuses to compare mismatched types, and ints too big for the column
+        pass
+
+    return None
+
+
+# NumPy stores every str of a column in the width of the longest, so columns
+# with longer strs than this are sorted by sorted() instead
+_argsort_max_chars = 64
+
+
+def _argsort(records, indices, reverse):
+    """
+    Returns the positions of records in stable sorted order of the given fields
+    (or of the records themselves if indices is None), computed by NumPy, or None
+    if a field holds anything but only ints, only floats or only strs (the types
+    NumPy orders exactly like Python does), or strs longer than _argsort_max_chars.
+    """
+    columns = []
+
+    for i in (indices if indices is not None else [None]):
+        column = [rec[i] for rec in records] if i is not None else records
+        types = set(map(type, column))
+
+        if len(types) != 1:
+            return None
+
+        kind = types.pop()
+
+        if kind not in (int, float, str) or (kind is str and max(map(len, column)) > _argsort_max_chars):
+            return None
+
+        column = np.array(column)
+
+        if column.dtype.kind not in 'iufU':
+            return None
+
+        columns.append(column)
+
+    if not columns:
+        return None
+
+    return _lexsort(columns, reverse).tolist()
+
+
+def _lexsort(columns, reverse):
+    """Returns the NumPy array of positions that sorts the rows of the columns stably."""
+
+    # lexsort orders by the last key first; for reverse order, sorting the
+    # reversed rows and flipping the result keeps equal rows stable
+    if not reverse:
+        return np.lexsort(columns[::-1])
+
+    last = len(columns[0]) - 1
+    order = np.lexsort([c[::-1] for c in columns[::-1]])[::-1]
+
+    return last - order
+
+
 class Key(object):
     """Callable class that returns a key calculation function when invoked."""
 
     def __init__(self, *args):
         self.args = args
 
+    def __setattr__(self, name, value):
+        # changing the key discards the function memoized by __call__()
+        object.__setattr__(self, name, value)
+
+        if name == 'args':
+            # (field, cast) pairs, where cast is None for fields used as they are
+            object.__setattr__(self, 'fields', [a if isinstance(a, tuple) else (a, None) for a in value])
+
+        if name != '_func':
+            object.__setattr__(self, '_func', None)
+
     def __call__(self):
-        """Returns a function that when passed a record returns the key values."""
+        """Returns a function that when passed a record returns the key values.
+        The function is memoized until the args or the zero_based setting change."""
+        global _zero_based
+
+        if self._func is None or self._func[0] != _zero_based:
+            self._func = (_zero_based, self._build_func())
+
+        return self._func[1]
+
+    def _build_func(self):
+        """Returns a new function that when passed a record returns the key values."""
         global _zero_based
         args = self.args
 
+        # keys of field numbers are compiled into a function that builds the list
+        # directly, e.g. 'return [rec[0], _cast1(rec[3])]'
+        if all(isinstance(f, int) for f, cast in self.fields):
+            terms = []
+            namespace = {}
+
+            for n, (f, cast) in enumerate(self.fields):
+                if cast is None:
+                    terms.append('rec[{}]'.format(int(field_index(f))))
+                else:
+                    namespace['_cast{}'.format(n)] = cast
+                    terms.append('_cast{}(rec[{}])'.format(n, int(field_index(f))))
+
+            params = ''.join(', {0}={0}'.format(name) for name in sorted(namespace))
+            source = _KEY_TEMPLATE.format(params=params, terms=', '.join(terms))
+
+            return _compile_function('key', source, namespace)
+
         if not _zero_based:
             args = [(a[0] - 1, a[1]) if isinstance(a, tuple) else a - 1 for a in args]
 
-        def func(rec):
-            # if the argument was a tuple, then the second item is a type
-            # to which the value in the first item should be cast
+        def func(rec):
+            # if the argument was a tuple, then the second item is a type
+            # to which the value in the first item should be cast
+
+            result = [
+                a[1](rec[a[0]]) if isinstance(a, tuple) else rec[a]
+                for a in args
+            ]
+
+            return result
+
+        return func
+
+    def sort_key(self):
+        """
+        Returns a function whose values order records the same way as the values of
+        the key function.  Without casts it is an operator.itemgetter, which returns
+        a value or a tuple of values in C instead of building a list, so it is meant
+        for sorting rather than for using the values.
+        """
+        if self.args and self.reads_fields():
+            return operator.itemgetter(*[field_index(a) for a in self.args])
+
+        return self()
+
+    def reads_fields(self):
+        """Returns True if the key is made only of field numbers without casts and
+        has the __call__() of Key, so that the fields can be read directly rather
+        than through the function from __call__()."""
+        call = type(self).__call__
+
+        return getattr(call, '__func__', call) is _key_call and all(isinstance(a, int) for a in self.args)
+
+    def apply_batch(self, batch):
+        """
+        Returns the key values for every record of a columnar batch at once, by
+        selecting the key's columns and casting them as a whole.
+
+        :param batch: A pyarrow RecordBatch or Table, a NumPy structured array, or a
+                      two dimensional NumPy array with one column per field.
+        :return:      A batch of the same kind with one column per key value.
+        """
+        if _is_structured(batch):
+            columns = [
+                _batch_column(batch, field_index(f)) if cast is None
+                else _cast_array(_batch_column(batch, field_index(f)), cast)
+                for f, cast in self.fields
+            ]
+            result = np.empty(len(batch), dtype=[('f{}'.format(i), c.dtype) for i, c in enumerate(columns)])
+
+            for i, column in enumerate(columns):
+                result['f{}'.format(i)] = column
+
+            return result
+
+        if np is not None and isinstance(batch, np.ndarray):
+            columns = [
+                batch[:, field_index(f)] if cast is None else _cast_array(batch[:, field_index(f)], cast)
+                for f, cast in self.fields
+            ]
+
+            return np.column_stack(columns) if columns else batch[:, :0]
+
+        columns = [
+            batch.column(field_index(f)) if cast is None else _cast_column(batch.column(field_index(f)), cast)
+            for f, cast in self.fields
+        ]
+
+        return type(batch).from_arrays(columns, names=['f{}'.format(i) for i in range(0, len(columns))])
+
+
+# the __call__() of Key itself, which subclasses that don't override it inherit
+_key_call = getattr(Key.__call__, '__func__', Key.__call__)
+
+
+if np is not None:
+    _numpy_casts = {int: np.int64, float: np.float64, str: np.str_}
+else:
+    _numpy_casts = {}
+
+# the names of the pyarrow types, looked up once pyarrow is imported
+_arrow_casts = {int: 'int64', float: 'float64', str: 'string'}
+
+
+# the kinds of NumPy column that astype() converts exactly as the cast does for
+# each value: floats are formatted differently than str() does, bytes are
+# decoded rather than shown as b'...', and uint64 values can overflow int64
+
+_numpy_cast_kinds = {int: 'iubUf', float: 'iubUf', str: 'iubU'}
+
+
+def _cast_array(column, cast):
+    """Returns a NumPy column with every value converted by cast, vectorized when
+    NumPy converts the same way Python does, else one value at a time."""
+    target = _numpy_casts.get(cast)
+    kind = column.dtype.kind
+
+    if target is not None and kind in _numpy_cast_kinds[cast] and not (kind == 'u' and column.dtype.itemsize >= 8):
+        # int() raises for NaN and infinity, and doesn't overflow, where astype()
+        # gives a meaningless value
+        if cast is int and kind == 'f' and not (np.isfinite(column).all() and (np.abs(column) < 2.0 ** 63).all()):
+            target = None
+
+        if target is not None:
+            try:
+                return column.astype(target)
+            except (TypeError, ValueError, OverflowError):
+                # e.g. an int() too big for int64
+                pass
+
+    return np.array([cast(v) for v in column.tolist()])
+
+
+def _arrow_castable(column_type, cast):
+    """Returns True if pyarrow casts values of the type the same way cast does.
+    pyarrow parses strings differently than int() and float(), e.g. '0x10', and
+    formats floats, bools and timestamps differently than str() does."""
+    if cast is str:
+        return pa.types.is_string(column_type) or pa.types.is_integer(column_type)
+
+    return pa.types.is_integer(column_type) or pa.types.is_boolean(column_type) or pa.types.is_floating(column_type)
+
+
+def _cast_column(column, cast):
+    """Returns a pyarrow column with every value converted by cast, vectorized when
+    pyarrow converts the same way Python does, else one value at a time."""
+    _import_pyarrow()
+    target = _arrow_casts.get(cast)
+
+    if target is not None:
+        target = getattr(pa, target)()
+
+    # nulls go through cast(None), which raises like it does for the records
+    if target is not None and column.null_count == 0 and _arrow_castable(column.type, cast):
+        try:
+            return column.cast(target)
+        except (TypeError, ValueError, NotImplementedError, OverflowError):
+            # e.g. pyarrow won't truncate 1.5 or convert NaN, but int() will or
+            # raises its own error
+            pass
+
+    return pa.array([cast(v) for v in column.to_pylist()])
+
+
+class FullRecord(Key):
+    """Subclass of Key that returns the entire record as the key."""
+
+    def __call__(self):
+        """Returns a function that in turn returns the entire record as the key."""
+        def func(rec):
+            return rec
+
+        return func
+
+
+class Reformat(object):
+    """Base class for providing custom transformations."""
+
+    def transform(self, in_rec):
+        """Returns the transformed record.  Override as needed."""
+        return in_rec
+
+
+class CsvSplitReformat(Reformat):
+    """
+    Reformat that splits text records into fields at the delimiter, e.g. to parse
+    records that came from somewhere other than a CsvReader.  Subclasses can
+    change delim, and convert fields by overriding transform() to work on the
+    list from super().transform(), so each record is split only once rather than
+    once per field.
+    """
+
+    delim = ','
+
+    def transform(self, in_rec):
+        """Returns the fields of the record."""
+        return in_rec.split(self.delim)
+
+
+def _hands_off(iter_method):
+    """
+    Decorates the __iter__() of a chainable so that a len() invoked after getting
+    an iterator but before asking it for a record, as list(chain) does, reads the
+    records for that iterator, and the chain only runs once.  The records are
+    only kept for that one iterator.  The iterator is a chain.from_iterable() over
+    the records, so they pass through C rather than a Python generator.
+    """
+    @functools.wraps(iter_method)
+    def __iter__(self):
+        return chain.from_iterable(_picked(self, iter_method))
+
+    return __iter__
+
+
+def _closing_hands_off(iter_method):
+    """Like _hands_off(), for the __iter__() of a reader that owns a file.  The
+    iterator is a generator, and closing it closes the iterator of the reader,
+    and with it the file."""
+    @functools.wraps(iter_method)
+    def __iter__(self):
+        picked = _picked(self, iter_method)
+        return _closing(chain.from_iterable(picked), picked)
+
+    return __iter__
 
-            result = [
-                a[1](rec[a[0]]) if isinstance(a, tuple) else rec[a]
-                for a in args
-            ]
 
-            return result
+def _picked(self, iter_method):
+    """Returns a generator that yields the iterator over the records of the step
+    once it is asked for it, holding it in self._handoff until then."""
+    handoff = []
+    picked = _pick(self, iter_method, handoff)
 
-        return func
+    # a weak reference, so that an iterator that was dropped unused doesn't
+    # make len() keep the records
+    self._handoff = weakref.ref(picked), handoff
 
+    return picked
 
-class FullRecord(Key):
-    """Subclass of Key that returns the entire record as the key."""
 
-    def __call__(self):
-        """Returns a function that in turn returns the entire record as the key."""
-        def func(rec):
-            return rec
+def _pick(self, iter_method, handoff):
+    """Yields an iterator over the records that len() put in the handoff list, or
+    else the iterator of iter_method(), which is closed when this generator is."""
+    if self.__dict__.get('_handoff', (None, None))[1] is handoff:
+        del self._handoff
 
-        return func
+    records = iter(handoff.pop()) if handoff else iter_method(self)
 
+    try:
+        yield records
+    finally:
+        close = getattr(records, 'close', None)
 
-class Reformat(object):
-    """Base class for providing custom transformations."""
+        if close is not None:
+            close()
 
-    def transform(self, in_rec):
-        """Returns the transformed record.  Override as needed."""
-        return in_rec
+
+def _closing(records, picked):
+    """Yields the records, closing the generator that picked them when closed."""
+    try:
+        for rec in records:
+            yield rec
+    finally:
+        picked.close()
 
 
 class AbstractChainable(object):
@@ -230,9 +1181,9 @@ class AbstractChainable(object):
         filter_inst = Cond(field, op, value)
         return self.chain(FilterChainable(filter_inst))
 
-    def grep(self, regex):
-        """Adds a grep (filter using regexp) step to the chain."""
-        filter_func = re.compile(regex).search
+    def grep(self, regex, flags=0, engine='re'):
+        """Adds a grep (filter using regexp) step to the chain.  See compiled_search() for the engines."""
+        filter_func = compiled_search(regex, flags, engine)
         return self.chain(FilterChainable(filter_func))
 
     def transform(self, transform_item):
@@ -246,13 +1197,34 @@ class AbstractChainable(object):
         # fields from a record in a certain way, so it can also be
         # re-purposed to act like the Unix "cut" utility
         key_inst = Key(*cut_params)
-        return self.chain(TransformChainable(key_inst()))
+        batch_func = key_inst.apply_batch if cut_params else None
+        return self.chain(TransformChainable(key_inst(), batch_func))
+
+    def reduce(self, transform_class, *sort_params, **kwargs):
+        """Adds a reduce step (i.e., aggregation or rollup) to the chain.
+
+        By default the records must already be sorted by the key, like the Unix
+        'uniq' utility expects.  Pass presorted=False to group records of any
+        order by hashing their keys instead (see HashReduceChainable).  A Uniq or
+        UniqCount reduce right after a sort by the same key hashes the keys too,
+        and only sorts the distinct ones.
+        """
+        presorted = kwargs.pop('presorted', True)
+
+        if kwargs:
+            raise TypeError('reduce() got an unexpected keyword argument {!r}'.format(next(iter(kwargs))))
 
-    def reduce(self, transform_class, *sort_params):
-        """Adds a reduce step (i.e., aggregation or rollup) to the chain."""
         key_inst = Key(*sort_params)
+
+        if not presorted:
+            return self.chain(HashReduceChainable(key_inst, transform_class))
+
         return self.chain(ReduceChainable(key_inst, transform_class))
 
+    def counting(self):
+        """Adds a step that counts records as they pass, so len() is free after a full iteration."""
+        return self.chain(CountingChainable())
+
     def show(self, row_number=False, print_function=None):
         """Displays all records in the stream to stdout or using the print_function, if supplied."""
         global _verbose, writeln
@@ -263,12 +1235,12 @@ class AbstractChainable(object):
         if print_function is None:
             print_function = writeln
 
+        # the loops run inside map() and are drained by a zero-length deque,
+        # so no Python bytecode executes between records
         if not row_number:
-            for rec in self:
-                print_function(rec)
+            deque(map(print_function, self), maxlen=0)
         else:
-            for i, rec in enumerate(self):
-                print_function('{}: {}'.format(i + 1, rec))
+            deque(map(print_function, starmap('{}: {}'.format, enumerate(self, 1))), maxlen=0)
 
         return self
 
@@ -282,11 +1254,7 @@ class AbstractChainable(object):
         if print_function is None:
             print_function = writeln
 
-        for i, rec in enumerate(self):
-            print_function(rec)
-
-            if i == 4:
-                break
+        deque(map(print_function, islice(self, 5)), maxlen=0)
 
         return self
 
@@ -300,7 +1268,7 @@ class AbstractChainable(object):
         if print_function is None:
             print_function = writeln
 
-        print_function('%s %s' % (message or 'count', len(self)))
+        print_function('%s %s' % (message or 'count', self._count_records()))
 
         return self
 
@@ -308,11 +1276,150 @@ class AbstractChainable(object):
         """Subclasses must implement to yield records in the stream."""
         raise NotImplementedError('concrete subclasses must implement __iter__()')
 
+    def batches(self):
+        """Returns an iterator of columnar record batches, or None if this step
+        can only produce individual records.  Override in columnar subclasses."""
+        return None
+
+    def _compile_plan(self):
+        """
+        Walks up the chain from this step through consecutive filter and transform
+        steps and returns the first other step (the source) along with a list of
+        ('filter', func), ('map', func) and ('scan', func) stages, in the order they
+        apply, leaving out transforms that return records unchanged and combining
+        consecutive hyperscan greps into one filter.  A scan stage is a generator
+        over the records that tests a run of consecutive Cond filters inline.  A run
+        of conditions that no record can pass becomes an ('empty', None) stage
+        instead.  A subclass step that overrides __iter__() or iter_records() is
+        treated as the source, so that its own iteration runs.
+        """
+        node = self
+        stages = []
+
+        while True:
+            stage = node._stage()
+            node = node.parent
+
+            if stage is not None:
+                stages.append(stage)
+
+            # a step that produces batches evaluates its own records in bulk
+            if not _fusable(node) or node.batches() is not None:
+                break
+
+        stages.reverse()
+        stages = _fuse_greps(stages)
+
+        # consecutive conditions become a single generated scan over the records
+        fused = []
+
+        for kind, item in stages:
+            if kind == 'cond' and fused and fused[-1][0] == 'cond':
+                fused[-1][1].append(item)
+            else:
+                fused.append((kind, [item] if kind == 'cond' else item))
+
+        return node, [(('empty', None) if _contradictory(item) else ('scan', _compile_conds(item, True)))
+                      if kind == 'cond' else (kind, item) for kind, item in fused]
+
+    def _fused_iter(self):
+        """
+        Returns an iterator over the records of this step that runs all of the
+        stages from _compile_plan() as nested filter() and map() iterators and
+        generated scans over the source, so records pass through C iterators and
+        inlined tests rather than one Python generator per step.
+        """
+        source, stages = self._compile_plan()
+
+        # nothing can pass, so don't even read the source
+        if any(kind == 'empty' for kind, func in stages):
+            return iter([])
+
+        records = iter(source)
+
+        for kind, func in stages:
+            if kind == 'scan':
+                records = func(records)
+            else:
+                records = filter(func, records) if kind == 'filter' else map(func, records)
+
+        return records
+
     def __len__(self):
-        """Permits AbstractChainable to function correctly if len() is invoked on it."""
+        """Permits AbstractChainable to function correctly if len() is invoked on it.
+
+        The records are counted without keeping them, except when an iterator of
+        this step hasn't been asked for a record yet, as in list(chain), which gets
+        the records read here instead of running the chain again.
+        """
+        ref, handoff = self.__dict__.pop('_handoff', (None, None))
+
+        if ref is None or ref() is None:
+            return self._count_records()
+
+        # invoking iter avoids list() asking for len(self) recursively
+        records = list(iter(self))
+        handoff.append(records)
+
+        return len(records)
+
+    def _count_records(self):
+        """Returns the number of records in the stream without keeping them."""
+
+        # zip() pairs every record with the next number from the counter and the
+        # zero-length deque discards the pairs, all in C
+        counter = count()
+        deque(zip(iter(self), counter), maxlen=0)
+
+        return next(counter)
+
+
+class BatchChainable(AbstractChainable):
+    """
+    Base class for steps that can work on the columnar batches of their parent
+    as well as on individual records.
+
+    When the parent produces batches and apply_batches() accepts them, the step
+    produces batches too, and iterating over it yields the rows of those batches.
+    Otherwise it works record at a time through iter_records().  Once a step can't
+    produce batches, e.g. a transform with a function or Reformat, every step after
+    it works on records.
+    """
+
+    @_hands_off
+    def __iter__(self):
+        """Yields the rows of this step's batches if there are any, else its records."""
+        batches = self.batches()
+
+        if batches is not None:
+            return chain.from_iterable(map(batch_rows, batches))
+
+        return self.iter_records()
+
+    def batches(self):
+        """Returns an iterator of this step's batches if the parent produces batches
+        and this step can work on them, else None."""
+        batches = self.parent.batches() if self.parent is not None else None
+
+        if batches is None:
+            return None
+
+        return self.apply_batches(batches)
+
+    def apply_batches(self, batches):
+        """Returns an iterator of this step's batches given the parent's batches, or
+        None if it can't work on them.  Applies apply_batch() to every batch unless
+        overridden."""
+        return map(self.apply_batch, batches)
+
+    def apply_batch(self, batch):
+        """Returns this step's batch given a batch of the parent.  Override in subclasses."""
+        raise NotImplementedError('Subclass must implement apply_batch()')
 
-        # invoking iter avoids recursive behavior of len(list(self))
-        return len(list(iter(self)))
+    def iter_records(self):
+        """Returns an iterator over the records of this step, without batches.
+        Override in subclasses."""
+        raise NotImplementedError('Subclass must implement iter_records()')
 
 
 class IterReader(AbstractChainable):
@@ -322,30 +1429,115 @@ class IterReader(AbstractChainable):
         super(IterReader, self).__init__()
         self.iterable = iterable
 
+    @_hands_off
     def __iter__(self):
         """Yields records from an iterable source."""
         if self.iterable is None:
             self.iterable = []
 
-        for i in self.iterable:
-            yield i
+        if _is_structured(self.iterable):
+            return batch_rows(self.iterable)
+
+        # hand out the source's own iterator rather than re-yielding every record
+        return iter(self.iterable)
+
+    def __len__(self):
+        """Returns the length of a source that has one, e.g. a list, without iterating
+        over it, and otherwise counts the records as AbstractChainable does."""
+        if self.iterable is None:
+            return 0
+
+        try:
+            return len(self.iterable)
+        except TypeError:
+            return super(IterReader, self).__len__()
+
+    def batches(self):
+        """Returns an iterator with the NumPy structured array this reader reads from
+        as its only batch, or None for any other iterable."""
+        if _is_structured(self.iterable):
+            return iter([self.iterable])
+
+        return None
+
+    def to_numpy(self, dtype=None):
+        """
+        Returns an IterReader over the records loaded into a NumPy structured array,
+        so that the filter, cut and sort steps chained to it work a column at a time.
+
+        :param dtype: The structured dtype, with one field per record field, e.g.
+                      [('sku', 'U20'), ('price', 'f8')].  By default NumPy picks
+                      the type of each column from the values.
+        :return:      An IterReader.
+        """
+        if np is None:
+            raise ImportError('to_numpy() requires numpy')
+
+        records = list(map(tuple, self))
+
+        if dtype is None and records:
+            return IterReader(np.rec.fromrecords(records).view(np.ndarray))
+
+        return IterReader(np.array(records, dtype=dtype))
+
+    def parallel_batches(self, n):
+        """
+        Splits the records into n lists of consecutive records, e.g. to hand to
+        run_parallel() as its inputs.  Concatenating the lists gives back the records
+        in their original order.
+        """
+        if n < 1:
+            raise ValueError('parallel_batches() needs at least one batch, not {}'.format(n))
+
+        records = list(self)
+        size = -(-len(records) // n) or 1
+
+        return [records[i * size:(i + 1) * size] for i in range(n)]
 
 
 class FileReader(AbstractChainable):
     """Concrete subclass of AbstractChainable that iterates over the records of a file."""
 
+    # size of the read buffer; the io layer reads the file a block at a time and
+    # splits lines in C, which measured faster than splitting blocks in Python
+    buffer_size = 1 << 20
+
+    # mode the file is opened with; 'rb' yields bytes records instead of str
+    mode = 'r'
+
+    # newline translation of a file opened in text mode, as for open(); None
+    # translates '\r\n' and '\r' to '\n'
+    newline = None
+
     def __init__(self, filename):
         super(FileReader, self).__init__()
         self.filename = filename
 
+    @_closing_hands_off
     def __iter__(self):
         """Yield records from a file."""
-        fp = open(self.filename)
+        return self._read_file()
+
+    def _read_file(self):
+        """Yield the records of the file, reading it line at a time."""
+        # the with statement also closes the file when the generator is closed
+        # before the end, e.g. by head() or an exception in a later step
+        kwargs = {'newline': self.newline} if self.newline is not None else {}
+
+        with open(self.filename, self.mode, buffering=self.buffer_size, **kwargs) as fp:
+            self.read_headers(fp)
 
-        for rec in fp:
-            yield self.prep_record(rec)
+            for rec in self.read_records(fp):
+                yield rec
 
-        fp.close()
+    def read_headers(self, fp):
+        """Invoked with the opened file before any records are read.  Override as needed."""
+        pass
+
+    def read_records(self, fp):
+        """Returns an iterator over the records of the opened file after the headers,
+        which applies prep_record() to every line.  Override as needed."""
+        return map(self.prep_record, fp)
 
     def prep_record(self, rec):
         """Returns a data record with record delimiters stripped off."""
@@ -354,18 +1546,49 @@ class FileReader(AbstractChainable):
 
 class CsvReader(FileReader):
     """Concrete subclass of AbstractChainable that iterates over the records
-    of a file and splits them into fields using a delimiter."""
+    of a file and splits them into fields using a delimiter.
+
+    Pass decode=False to skip decoding the file: records, fields and header records
+    are then bytes, which saves decoding when fields are only compared against
+    bytes values or written back out.
+
+    Fields are split at every delimiter, which is the fastest way to parse plain
+    files.  Pass quoted=True for files with quoted fields that may contain the
+    delimiter or line breaks; they are then parsed by the csv module, which takes
+    quotes out and doesn't strip whitespace, and only takes a single character
+    delimiter.  Quoted fields aren't supported on Python 2.
+    """
 
-    def __init__(self, filename, delim=None, headers=None):
+    def __init__(self, filename, delim=None, headers=None, decode=True, quoted=False):
         super(CsvReader, self).__init__(filename)
         self.delim = delim or ','
+        self.delim_bytes = self.delim.encode('utf-8')
         self.headers = headers if headers is not None else 1
         self.header_records = []
+        self.decode = decode
+        self.quoted = quoted
 
-    def __iter__(self):
-        """Yields records split into fields using the delimiter."""
-        fp = open(self.filename)
+        if quoted and not decode:
+            raise RuntimeError('quoted fields can only be parsed with decode=True')
+
+        if quoted and len(self.delim) != 1:
+            raise RuntimeError('quoted fields can only be parsed with a single character delimiter')
+
+        # the csv module of Python 2 only reads bytes, which would make quoted
+        # records differ from the str records of Python 3
+        if quoted and sys.version_info < (3,):
+            raise RuntimeError('quoted fields can only be parsed on Python 3')
 
+        if not decode:
+            self.mode = 'rb'
+
+        # the csv module reads line endings itself, so that the ones inside quoted
+        # fields are kept as they are
+        if quoted:
+            self.newline = ''
+
+    def read_headers(self, fp):
+        """Reads past the header records, keeping them the first time the file is read."""
         if self.header_records:
             for i in range(0, self.headers):
                 fp.readline()
@@ -373,73 +1596,340 @@ class CsvReader(FileReader):
             for i in range(0, self.headers):
                 self.header_records.append(fp.readline().strip())
 
-        for rec in fp:
-            yield self.prep_record(rec)
+    def read_records(self, fp):
+        """Returns an iterator over the records of the opened file after the headers."""
+        if self.quoted:
+            return csv.reader(fp, delimiter=self.delim)
 
-        fp.close()
+        return super(CsvReader, self).read_records(fp)
 
     def prep_record(self, rec):
         """Returns a record stripped of record delimiters and split by the field delimiter."""
-        return rec.strip().split(self.delim)
+        return rec.strip().split(self.delim if self.decode else self.delim_bytes)
+
+
+class ArrowCsvReader(CsvReader):
+    """Subclass of CsvReader that parses the file a block at a time using pyarrow.
+
+    The parsing is done in C and the underlying pyarrow RecordBatch objects are
+    available through batches().  Records are lists of fields like those of
+    CsvReader, with quotes kept as part of the fields, but pyarrow differs from
+    the line parser in that:
+
+    * blank lines are skipped rather than read as ['']
+    * whitespace at the ends of a line is kept in its first and last fields
+    * a line with a different number of fields than the first raises
+      pyarrow.lib.ArrowInvalid
+
+    By default every field is a str, just like CsvReader.  Pass infer_types=True
+    to let pyarrow convert numeric columns.  pyarrow only supports single
+    character delimiters, so with a longer one the file is read by the CsvReader
+    line parser, and batches() returns None.
+    """
+
+    # number of bytes pyarrow parses at a time; the line parser reads through a
+    # buffer of FileReader.buffer_size instead
+    block_size = 64 << 20
+
+    def __init__(self, filename, delim=None, headers=None, infer_types=False):
+        if not _import_pyarrow():
+            raise ImportError('ArrowCsvReader requires pyarrow')
+
+        super(ArrowCsvReader, self).__init__(filename, delim, headers)
+        self.infer_types = infer_types
+
+    @_closing_hands_off
+    def __iter__(self):
+        """Yields records split into fields, parsed in blocks by pyarrow when possible."""
+        batches = self.batches()
+
+        if batches is None:
+            return self._read_file()
+
+        return chain.from_iterable(map(batch_rows, batches))
+
+    def batches(self):
+        """Returns an iterator of pyarrow RecordBatch objects, or None if the
+        file is parsed line at a time instead."""
+
+        # pyarrow only supports single character delimiters
+        if len(self.delim) != 1:
+            return None
+
+        return self._read_batches()
+
+    def _read_batches(self):
+        """Yields pyarrow RecordBatch objects parsed from the file."""
+        with open(self.filename, 'rb') as fp:
+            header_records = [fp.readline().decode('utf-8').strip() for i in range(0, self.headers)]
+
+            if not self.header_records:
+                self.header_records = header_records
+
+            # peek at the first record, both to detect an empty file (which pyarrow
+            # rejects) and to learn the number of columns when they are kept as str
+            pos = fp.tell()
+            first_rec = fp.readline()
+
+            while first_rec and not first_rec.strip():
+                first_rec = fp.readline()
+
+            if not first_rec:
+                return
+
+            fp.seek(pos)
 
+            read_options = pacsv.ReadOptions(block_size=self.block_size, autogenerate_column_names=True)
+            # quotes are kept in the fields, as the line parser does
+            parse_options = pacsv.ParseOptions(delimiter=self.delim, quote_char=False)
 
-class SortChainable(AbstractChainable):
+            if self.infer_types:
+                convert_options = pacsv.ConvertOptions()
+            else:
+                columns = pacsv.read_csv(io.BytesIO(first_rec), read_options=read_options,
+                                         parse_options=parse_options).column_names
+                convert_options = pacsv.ConvertOptions(column_types={c: pa.string() for c in columns})
+
+            reader = pacsv.open_csv(fp, read_options=read_options, parse_options=parse_options,
+                                    convert_options=convert_options)
+
+            for batch in reader:
+                yield batch
+
+
+class SortChainable(BatchChainable):
     """A chainable subclass of AbstractChainable that sorts records."""
 
+    # with fewer records than this, sorted() is faster than building NumPy arrays
+    argsort_min_size = 1 << 14
+
     def __init__(self, key, reverse=None):
         super(SortChainable, self).__init__()
         self.key = key
         self.reverse = reverse or False
 
-    def __iter__(self):
-        """Yield records sorted by the specified key."""
+    def iter_records(self):
+        """Returns an iterator over the records sorted by the specified key."""
         if isinstance(self.key, Key):
-            key = self.key()
+            key = self.key.sort_key()
         else:
             key = None
 
-        for rec in sorted(self.parent, key=key, reverse=self.reverse):
-            yield rec
+        indices = self.key_indices()
+
+        if np is None or indices is None:
+            return iter(sorted(self.parent, key=key, reverse=self.reverse))
+
+        records = list(self.parent)
+
+        if len(records) >= self.argsort_min_size:
+            if not indices:
+                # full records are compared field by field when they are all the same
+                # length, and are otherwise treated as a single value
+                lengths = set(len(rec) if isinstance(rec, (list, tuple)) else None for rec in records)
+                indices = range(0, lengths.pop()) if len(lengths) == 1 and None not in lengths else None
+
+            order = _argsort(records, indices, self.reverse)
+
+            if order is not None:
+                return map(records.__getitem__, order)
+
+        records.sort(key=key, reverse=self.reverse)
+        return iter(records)
+
+    def key_indices(self):
+        """Returns the zero-based fields of a key made only of plain field numbers,
+        an empty list when sorting full records, or None if the key has casts or
+        computes its values some other way, e.g. a subclass overriding __call__()."""
+        if not isinstance(self.key, Key) or type(self.key) is FullRecord:
+            return []
+
+        if self.key.reads_fields():
+            return [field_index(a) for a in self.key.args]
+
+        return None
 
+    def apply_batches(self, batches):
+        """Returns an iterator of sorted batches if the key has no casts, else None."""
+        indices = self.key_indices()
 
-class FilterChainable(AbstractChainable):
+        if indices is None:
+            return None
+
+        return self._sort_batches(batches, indices)
+
+    def _sort_batches(self, batches, indices):
+        """Yields the batches combined into a single sorted batch per chunk of the table,
+        or a single sorted structured array."""
+        batches = list(batches)
+
+        if not batches:
+            return
+
+        if _is_structured(batches[0]):
+            array = np.concatenate(batches)
+            names = array.dtype.names
+            yield array[_lexsort([array[names[i]] for i in (indices or range(0, len(names)))], self.reverse)]
+            return
+
+        _import_pyarrow()
+        table = pa.Table.from_batches(batches)
+        names = table.column_names
+        order = 'descending' if self.reverse else 'ascending'
+        sort_keys = [(names[i], order) for i in (indices or range(0, len(names)))]
+
+        for batch in table.take(pc.sort_indices(table, sort_keys=sort_keys)).to_batches():
+            yield batch
+
+
+class FilterChainable(BatchChainable):
     """A chainable subclass of AbstractChainable that filters records."""
 
     def __init__(self, filter_inst):
         super(FilterChainable, self).__init__()
         self.filter_inst = filter_inst
 
-    def __iter__(self):
-        """Yields records filtered by the given Cond or function."""
-        if isinstance(self.filter_inst, Cond):
-            filter_func = self.filter_inst()
-        elif callable(self.filter_inst):
-            filter_func = self.filter_inst
+        # work out once how to get the filter function: calling a Cond returns it,
+        # and any other callable, e.g. re.compile().search, is used as it is.  Only
+        # the kind is kept, so that the step can still be pickled
+        if isinstance(filter_inst, Cond):
+            self._filter_kind = 'cond'
+        elif callable(filter_inst):
+            self._filter_kind = 'callable'
         else:
-            raise RuntimeError('only works with a Cond instance or re.compile.search')
+            self._filter_kind = None
 
-        for rec in filter(filter_func, self.parent):
-            yield rec
+    def iter_records(self):
+        """Returns an iterator over the records filtered by the given Cond or function."""
+        return self._fused_iter()
+
+    def _stage(self):
+        """Returns this step as a stage for AbstractChainable._compile_plan()."""
+        if isinstance(self.filter_inst, Cond) and self.filter_inst.inlinable():
+            return 'cond', self.filter_inst
+
+        return 'filter', self.filter_func()
+
+    def filter_func(self):
+        """Returns the function that decides whether a record passes the filter."""
+        if self._filter_kind == 'cond':
+            return self.filter_inst()
+
+        if self._filter_kind == 'callable':
+            return self.filter_inst
+
+        return _unsupported_filter()
+
+    def apply_batch(self, batch):
+        """Returns a new batch of the same kind with only the records of batch that pass the filter."""
+        mask = None
 
+        if isinstance(self.filter_inst, Cond) and self.filter_inst.reads_field():
+            mask = self.filter_inst.compile_mask(_batch_column(batch, field_index(self.filter_inst.field)))
 
-class TransformChainable(AbstractChainable):
+        if mask is None:
+            filter_func = self.filter_func()
+            values = [bool(filter_func(rec)) for rec in batch_rows(batch)]
+
+            if _is_structured(batch):
+                mask = np.array(values, dtype=bool)
+            else:
+                _import_pyarrow()
+                mask = pa.array(values, pa.bool_())
+
+        return batch[mask] if _is_structured(batch) else batch.filter(mask)
+
+
+def _fusable(node):
+    """Returns True if node is a filter or transform step whose records come from
+    the stages of AbstractChainable._compile_plan(), i.e. its class doesn't
+    override __iter__() or iter_records()."""
+    for base in (FilterChainable, TransformChainable):
+        if isinstance(node, base):
+            iter_method = type(node).__iter__
+            iter_records = type(node).iter_records
+
+            return (getattr(iter_method, '__func__', iter_method) is _batch_iter
+                    and getattr(iter_records, '__func__', iter_records) is _iter_records[base])
+
+    return False
+
+
+def _unsupported_filter():
+    """Stands in for the filter function when FilterChainable was given something unusable."""
+    raise RuntimeError('only works with a Cond instance or re.compile.search')
+
+
+class TransformChainable(BatchChainable):
     """A chainable subclass of AbstractChainable that transforms records."""
 
-    def __init__(self, transform_item):
+    def __init__(self, transform_item, batch_func=None):
         super(TransformChainable, self).__init__()
         self.transform_item = transform_item
-
-    def __iter__(self):
-        """Yields transformed records."""
-        if self.transform_item.__class__.__name__ == 'function':
-            xform = self.transform_item
-        elif issubclass(self.transform_item, Reformat):
-            xform = self.transform_item().transform
+        self.batch_func = batch_func
+
+        # work out once how to get the transform function: any callable that isn't a
+        # class (functions, lambdas, partials, bound methods, Key functions) is used
+        # as it is, and a Reformat subclass is instantiated every time records are read.
+        # Only the kind is kept, so that the step can still be pickled
+        if callable(transform_item) and not isinstance(transform_item, type):
+            self._xform_kind = 'function'
+        elif isinstance(transform_item, type) and issubclass(transform_item, Reformat):
+            self._xform_kind = 'reformat'
         else:
-            raise RuntimeError('compatible only with a function or Reformat')
+            self._xform_kind = None
 
-        for rec in self.parent:
-            yield xform(rec)
+    def iter_records(self):
+        """Returns an iterator over the transformed records."""
+        return self._fused_iter()
+
+    def batches(self):
+        """Returns an iterator of transformed batches if there is a batch_func, which
+        transforms a whole batch at once, and the parent produces batches, else None."""
+        if self.batch_func is None:
+            return None
+
+        return super(TransformChainable, self).batches()
+
+    def apply_batch(self, batch):
+        """Returns the batch transformed by batch_func."""
+        return self.batch_func(batch)
+
+    def _stage(self):
+        """Returns this step as a stage for AbstractChainable._compile_plan(), or None
+        for a Reformat that leaves records as they are."""
+        transform_func = self.transform_func()
+
+        if getattr(transform_func, '__func__', None) is _identity_transform:
+            return None
+
+        return 'map', transform_func
+
+    def transform_func(self):
+        """Returns the function that transforms each record."""
+        if self._xform_kind == 'function':
+            return self.transform_item
+
+        if self._xform_kind == 'reformat':
+            return self.transform_item().transform
+
+        return _unsupported_transform()
+
+
+# the __iter__() of BatchChainable and the iter_records() of FilterChainable and
+# TransformChainable, which subclasses that don't override them inherit
+_batch_iter = getattr(BatchChainable.__iter__, '__func__', BatchChainable.__iter__)
+_iter_records = {
+    base: getattr(base.iter_records, '__func__', base.iter_records) for base in (FilterChainable, TransformChainable)
+}
+
+# the transform() of Reformat itself, which subclasses that don't override it inherit
+_identity_transform = getattr(Reformat.transform, '__func__', Reformat.transform)
+
+
+def _unsupported_transform():
+    """Stands in for the transform function when TransformChainable was given something unusable."""
+    raise RuntimeError('compatible only with a function or Reformat')
 
 
 class AbstractReducer(object):
@@ -488,6 +1978,43 @@ class UniqCount(Uniq):
         return [key, 'count', self.context]
 
 
+class CountingChainable(AbstractChainable):
+    """A chainable subclass of AbstractChainable that passes records through
+    unchanged while counting them.  Once the stream has been iterated to the
+    end, len() and count() return that number without iterating again."""
+
+    def __init__(self):
+        super(CountingChainable, self).__init__()
+        self.counted = None
+
+    @_hands_off
+    def __iter__(self):
+        """Yields the records of the parent, remembering how many there were."""
+        self.counted = None
+        counted = 0
+
+        for rec in self.parent:
+            counted += 1
+            yield rec
+
+        self.counted = counted
+
+    def __len__(self):
+        """Returns the number of records counted by the last complete iteration."""
+        if self.counted is None:
+            return super(CountingChainable, self).__len__()
+
+        return self.counted
+
+    def _count_records(self):
+        """Returns the number of records counted by the last complete iteration,
+        counting them as AbstractChainable does if there wasn't one."""
+        if self.counted is None:
+            return super(CountingChainable, self)._count_records()
+
+        return self.counted
+
+
 class ReduceChainable(AbstractChainable):
     """A chainable subclass of AbstractChainable that summarizes records
     based on a key."""
@@ -497,12 +2024,80 @@ class ReduceChainable(AbstractChainable):
         self.key_inst = key_inst
         self.transform_class = transform_class
 
+    @_hands_off
     def __iter__(self):
         """Yield records from the output() method of the given AbstractReducer
         as governed by the supplied key."""
 
-        xform = self.transform_class()
         key_func = self.key_inst()
+
+        # sorting by the key only brings equal keys together for Uniq and UniqCount,
+        # so hash the keys of the unsorted records and sort just the distinct ones
+        if self.transform_class in (Uniq, UniqCount) and self._sorted_by_key():
+            return self._distinct(key_func)
+
+        # counting is common enough to group the keys in C instead of calling
+        # the reducer's methods for every record
+        if self.transform_class is UniqCount:
+            return self._count(key_func)
+
+        return self._reduce(key_func)
+
+    def _sorted_by_key(self):
+        """Returns True if the parent is an ascending sort by the same key as this step.
+        Subclasses of SortChainable and Key may sort differently, so they don't count."""
+        sort = self.parent
+
+        return (type(sort) is SortChainable and type(sort.key) is Key and type(self.key_inst) is Key
+                and not sort.reverse and sort.key.args == self.key_inst.args)
+
+    def _distinct(self, key_func):
+        """Returns the records that Uniq or UniqCount would after the parent sort,
+        counting the keys of the records before the sort."""
+        keys = list(map(key_func, self.parent.parent))
+
+        try:
+            counts = Counter(map(tuple, keys))
+            distinct = [(list(key), counts[key]) for key in sorted(counts)]
+        except TypeError:
+            # key values that can't be hashed, e.g. lists, are grouped by sorting
+            # all of the keys instead
+            keys.sort()
+            distinct = [(key, len(list(run))) for key, run in groupby(keys)]
+
+        if not distinct:
+            # the reducer's output for a stream without records
+            return iter([[None, 'count', 0]] if self.transform_class is UniqCount else [None])
+
+        if self.transform_class is UniqCount:
+            return iter([[key, 'count', n] for key, n in distinct])
+
+        return iter([key for key, n in distinct])
+
+    def _count(self, key_func):
+        """Yield the same records as UniqCount would, one run of equal keys at a time."""
+        prev_key = None
+        key = None
+        counted = 0
+
+        for key, run in groupby(map(key_func, self.parent)):
+            if prev_key is None:
+                prev_key = key
+
+            if key == prev_key:
+                counted += len(list(run))
+
+            elif key > prev_key:
+                yield [prev_key, 'count', counted]
+
+                prev_key = key
+                counted = len(list(run))
+
+        yield [key, 'count', counted]
+
+    def _reduce(self, key_func):
+        """Yield the output of the reducer every time the key changes."""
+        xform = self.transform_class()
         prev_key = None
         prev_rec = None
         curr_key = None
@@ -529,3 +2124,110 @@ class ReduceChainable(AbstractChainable):
             prev_rec = curr_rec
 
         yield xform.output(curr_key, curr_rec)
+
+
+class HashReduceChainable(AbstractChainable):
+    """A chainable subclass of AbstractChainable that summarizes records based
+    on a key without requiring them to be sorted.
+
+    Every distinct key gets its own instance of the AbstractReducer, which is
+    initialized with the key, reduces the records with that key and produces
+    its output once all records have been read, in the order the keys were
+    first seen.  Because each key has its own reducer, key_change() is never
+    invoked.  This uses memory for every distinct key, where ReduceChainable
+    only needs sorted input.
+    """
+
+    def __init__(self, key_inst, transform_class):
+        super(HashReduceChainable, self).__init__()
+        self.key_inst = key_inst
+        self.transform_class = transform_class
+
+    @_hands_off
+    def __iter__(self):
+        """Yield records from the output() method of one AbstractReducer per key."""
+        key_func = self.key_inst()
+
+        # counting is common enough to do it in C with a Counter
+        if self.transform_class is UniqCount:
+            counts = _OrderedCounter(map(tuple, map(key_func, self.parent)))
+            return iter([[list(key), 'count', n] for key, n in counts.items()])
+
+        return self._reduce(key_func)
+
+    def _reduce(self, key_func):
+        """Yield the output of a reducer per key after reducing all records."""
+        state = _ordered_dict()
+
+        for rec in self.parent:
+            key = key_func(rec)
+            entry = state.get(tuple(key))
+
+            if entry is None:
+                xform = self.transform_class()
+                xform.initialize(key)
+                entry = state[tuple(key)] = [xform, key, rec]
+
+            entry[0].reduce(key, rec)
+            entry[2] = rec
+
+        for xform, key, rec in state.values():
+            yield xform.output(key, rec)
+
+
+def _run_pipeline(factory, settings, item):
+    """Returns the records of the pipeline that factory builds for item."""
+    set_zero_based(settings[0])
+    set_verbose(settings[1])
+
+    return list(factory(item))
+
+
+# stands for 'spawn' where ProcessPoolExecutor accepts a start method, from Python
+# 3.7, and the platform's default before that
+_default_start_method = object()
+
+
+def run_parallel(factory, inputs, workers=None, start_method=_default_start_method):
+    """
+    Runs one pipeline per input in a pool of worker processes and returns a list
+    with the records of each pipeline, in the order of the inputs.
+
+    The factory is called with an input, e.g. a filename, in a worker process and
+    must return an AbstractChainable.  Because the factory and inputs are pickled to
+    reach the workers, the factory must be a function defined at the top level of
+    a module, not a lambda or a nested function.  The zero_based and verbose settings
+    are passed on to the workers.
+
+    From Python 3.7, workers are started with 'spawn' by default, since forking a
+    process after the thread pools of pyarrow have started can deadlock.
+    Like with any spawned process, a script calling this must guard its main code
+    with "if __name__ == '__main__':".
+
+    :param factory:      A top level function that builds a pipeline from an input.
+    :param inputs:       The inputs, e.g. filenames or the lists from
+                         IterReader.parallel_batches().
+    :param workers:      The number of processes; defaults to the number of processors.
+    :param start_method: The multiprocessing start method, or None for the platform's
+                         default.  Before Python 3.7 only the platform's default
+                         can be used, and passing any other raises RuntimeError.
+    :return:             A list of lists of records.
+    """
+    if ProcessPoolExecutor is None:
+        raise ImportError('run_parallel() requires concurrent.futures')
+
+    kwargs = {}
+
+    if sys.version_info < (3, 7):
+        if start_method is not None and start_method is not _default_start_method:
+            raise RuntimeError('a start method can only be chosen from Python 3.7')
+    elif start_method is not None:
+        if start_method is _default_start_method:
+            start_method = 'spawn'
+
+        kwargs['mp_context'] = multiprocessing.get_context(start_method)
+
+    func = functools.partial(_run_pipeline, factory, (_zero_based, _verbose))
+
+    with ProcessPoolExecutor(workers, **kwargs) as executor:
+        return list(executor.map(func, inputs))
@@ -1,10 +1,42 @@
+import functools
+import operator
+import pickle
+import re
+import subprocess
 import sys
 import unittest
+from collections import namedtuple
 from datetime import datetime
 import tempfile
 from decimal import Decimal
+import coreutils
 from coreutils import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None
+
 
 # make Python 2 unittest compatible with Python 3
 if sys.version_info.major < 3:
@@ -23,6 +55,10 @@ class OneBasedTest(unittest.TestCase):
         set_zero_based(False)
 
 
+# a call to a Collector; indexing it like the (args, kwargs) tuple works too
+Call = namedtuple('Call', 'args kwargs')
+
+
 class Collector(object):
 
     def __init__(self):
@@ -30,7 +66,7 @@ class Collector(object):
 
     def __call__(self, *args, **kwargs):
         # intended to make this object a callable replacement to print()
-        self.collector.append((args, kwargs))
+        self.collector.append(Call(args, kwargs))
 
 
 class TestCollector(unittest.TestCase):
@@ -41,6 +77,8 @@ class TestCollector(unittest.TestCase):
         print_replacement('Hello World')
 
         self.assertEqual(len(print_replacement.collector), 1)
+        self.assertEqual(print_replacement.collector[0].args, ('Hello World',))
+        self.assertEqual(print_replacement.collector[0][0][0], 'Hello World')
 
 
 class TestZeroBased(ZeroBasedTest):
@@ -97,6 +135,13 @@ class TestFlatten(ZeroBasedTest):
 
         self.assertEqual(['a', 1, 'b', 2, 'c', 2, 2, 'd', '3', 3, 3], flatten(i))
 
+    def test_iflatten(self):
+        i = iflatten(([1, 2], (3,), [], [4]))
+
+        self.assertFalse(isinstance(i, list))
+        self.assertEqual([1, 2, 3, 4], list(i))
+        self.assertEqual([['a'], 'b'], list(iflatten([[['a']], ['b']])))
+
 
 input_list = [
     ['59693-IL-9641352', 'Georgia', 'Green', 95.05, 7],
@@ -197,16 +242,16 @@ class TestCond(ZeroBasedTest):
 
         self.assertEqual(len(list(filter(c(), input_list))), 22)
 
-        # the function obtained by calling the instance is still tied to that instance,
-        # so even if you obtain the function and then change the operator, the function
-        # will adopt the change to the instance (it's like they are entangled!)
+        # the function obtained by calling the instance binds the operator when it is
+        # created, so changing the operator afterwards does not affect that function
 
         func = c()
         c.op = eq
 
         # the length should still be 22 because the function is using the 'ne' function
 
-        self.assertEqual(len(list(filter(func, input_list))), 2)
+        self.assertEqual(len(list(filter(func, input_list))), 22)
+        self.assertEqual(len(list(filter(c(), input_list))), 2)
 
     def test_is_in_str_set_list_tuple(self):
         data = [
@@ -240,6 +285,22 @@ class TestCond(ZeroBasedTest):
 
         self.assertEqual(len(list([_ for _ in data if f(_)])), 3)
 
+        # lists of unhashable values still work
+        c = Cond(1, is_in, [['David'], 'Jeff'])
+        f = c()
+
+        self.assertEqual(len(list([_ for _ in data if f(_)])), 1)
+
+        # so do field values that can't be hashed, alone and in a scan
+        data.append([70, ['David']])
+        c = Cond(1, is_in, ['David', ['David']])
+        f = c()
+
+        self.assertEqual([_ for _ in data if f(_)], [[52, 'David'], [70, ['David']]])
+        self.assertFalse(Cond(1, is_in, ['David', 'Jeff'])()([70, ['David']]))
+        self.assertEqual(list(IterReader(data).filter(1, is_in, ['David', 'Jeff']).filter(0, gt, 50)),
+                         [[52, 'David']])
+
     def test_use_in_for_loop(self):
         data = [
             [52, 'David'],
@@ -281,6 +342,156 @@ class TestCond(ZeroBasedTest):
         c = Cond(0, eq,  1)
 
         self.assertEqual(c.__repr__(), 'Cond(0, eq, 1)')
+        self.assertEqual(repr(Cond(1, lte, 'a')), 'Cond(1, lte, a)')
+
+    def test_generated_functions(self):
+        global input_list
+
+        for op in (eq, ne, gt, gte, lt, lte):
+            c = Cond(3, op, 100.31)
+            expected = [rec for rec in input_list if op(rec[3], 100.31)]
+
+            self.assertEqual(list(filter(c(), input_list)), expected, c)
+
+        # is_in becomes the 'in' operator
+        f = Cond(1, is_in, ('Spain', 'Italy'))()
+
+        self.assertEqual(f.__code__.co_filename, '<coreutils cond>')
+        self.assertEqual(list(filter(f, input_list)), [rec for rec in input_list if rec[1] in ('Spain', 'Italy')])
+
+        # functions of the same shape share the compiled code, but not the value
+        f, g = Cond(4, gt, 10)(), Cond(4, gt, 20)()
+
+        self.assertIs(f.__code__, g.__code__)
+        self.assertTrue(f([0, 0, 0, 0, 15]))
+        self.assertFalse(g([0, 0, 0, 0, 15]))
+
+    def test_overridden_get_value_func(self):
+        class Lower(Cond):
+            def get_value_func(self, item):
+                func = super(Lower, self).get_value_func(item)
+                return lambda rec: func(rec).lower()
+
+        self.assertFalse(Cond(0, eq, 'same')()(['SAME']))
+        self.assertTrue(Lower(0, eq, 'same')()(['SAME']))
+
+        records = [['ABC'], ['abc'], ['xyz']]
+
+        self.assertEqual([r for r in records if Lower(0, eq, 'abc')()(r)], [['ABC'], ['abc']])
+        self.assertEqual(list(IterReader(records).chain(FilterChainable(Lower(0, eq, 'abc')))), [['ABC'], ['abc']])
+        self.assertEqual(list(IterReader(records).chain(FilterChainable(Lower(0, ne, 'abc'))).filter(0, ne, 'x')),
+                         [['xyz']])
+
+    def test_overridden_call(self):
+        class Caseless(Cond):
+            def __call__(self):
+                return lambda rec: rec[self.field].lower() == self.value
+
+        records = [['Spain'], ['SPAIN'], ['Italy']]
+
+        self.assertFalse(Caseless(0, eq, 'spain').inlinable())
+        self.assertEqual(list(IterReader(records).chain(FilterChainable(Caseless(0, eq, 'spain')))),
+                         [['Spain'], ['SPAIN']])
+        self.assertEqual(list(IterReader(records).filter(0, ne, 'Italy')
+                              .chain(FilterChainable(Caseless(0, eq, 'spain')))), [['Spain'], ['SPAIN']])
+
+        # conditions that don't go through Cond.__call__() can't contradict each other
+        self.assertEqual(list(IterReader(records).filter(0, eq, 'SPAIN')
+                              .chain(FilterChainable(Caseless(0, eq, 'spain')))), [['SPAIN']])
+
+    def test_memoized_function(self):
+        c = Cond(0, gt, 10)
+        f = c()
+
+        self.assertIs(c(), f)
+
+        # changes to the instance or the zero_based setting give a new function
+        c.value = 20
+
+        self.assertIsNot(c(), f)
+        self.assertFalse(c()([15, 25]))
+
+        set_zero_based(False)
+
+        self.assertTrue(c()([15, 25]))
+
+        # instances for the same condition have their own functions, since
+        # subclasses may build them from state of their own
+        self.assertIsNot(Cond(0, gt, 20)(), c())
+
+        class Scaled(Cond):
+            def __init__(self, field, op, value, scale):
+                super(Scaled, self).__init__(field, op, value)
+                self.scale = scale
+
+            def get_value_func(self, item):
+                func = super(Scaled, self).get_value_func(item)
+                return lambda rec: func(rec) * self.scale
+
+        records = [[5], [10]]
+
+        self.assertEqual([r for r in records if Scaled(0, gt, 8, 2)()(r)], [[5], [10]])
+        self.assertEqual([r for r in records if Scaled(0, gt, 8, 1)()(r)], [[10]])
+
+        # is_in against a list sees later changes to the list, just like a pipeline does
+        values = ['a']
+        c = Cond(0, is_in, values)
+
+        self.assertFalse(c()(['b']))
+
+        values.append('b')
+
+        self.assertTrue(c()(['b']))
+        self.assertEqual(list(IterReader([['a'], ['b']]).chain(FilterChainable(c))), [['a'], ['b']])
+
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_compile_mask(self):
+        global input_list
+
+        prices = numpy.array([rec[3] for rec in input_list])
+        countries = numpy.array([rec[1] for rec in input_list])
+
+        for c, column in [(Cond(3, gt, 100.0), prices), (Cond(3, lte, 95.05), prices),
+                          (Cond(1, eq, 'Spain'), countries), (Cond(1, is_in, ('Spain', 'Italy')), countries)]:
+            expected = [c()(rec) for rec in input_list]
+
+            self.assertEqual(list(c.compile_mask(column)), expected, c)
+
+        # comparing numbers with str can't be vectorized without changing the result
+        self.assertIsNone(Cond(3, eq, '95.05').compile_mask(prices))
+        self.assertIsNone(Cond(3, gt, 100).compile_mask(prices))
+
+        # nor can comparing ints with floats, which NumPy converts to float64 first
+        recs = [[2 ** 53 + 1], [2 ** 53]]
+        i = IterReader(recs).to_numpy()
+
+        self.assertIsNone(Cond(0, eq, 2.0 ** 53).compile_mask(numpy.array([2 ** 53 + 1])))
+        self.assertEqual(list(i.filter(0, eq, 2.0 ** 53)), [[2 ** 53]])
+        self.assertEqual(list(i.filter(0, gt, 2.0 ** 53)), [[2 ** 53 + 1]])
+        self.assertIsNone(Cond(1, is_in, 'Spain Italy').compile_mask(countries))
+
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_compile_mask_with_out_of_range_int(self):
+        column = numpy.arange(100, dtype=numpy.int64)
+
+        for c in [Cond(0, lt, 2 ** 64), Cond(0, gt, -2 ** 63 - 1), Cond(0, is_in, [1, 2 ** 64])]:
+            self.assertIsNone(c.compile_mask(column), c)
+
+        # the records are filtered one by one instead
+        i = IterReader([[n] for n in range(0, 100)]).to_numpy()
+
+        self.assertEqual(len(list(i.filter(0, lt, 2 ** 64))), 100)
+
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_compile_mask_over_structured_array(self):
+        global input_list
+
+        # the columns of a structured array are strided views
+        i = IterReader(input_list).to_numpy()
+
+        for op in (eq, ne, gt, gte, lt, lte):
+            self.assertEqual(list(i.filter(4, op, 11)), [r for r in input_list if op(r[4], 11)], op)
+            self.assertEqual(list(i.filter(3, op, 100.31)), [r for r in input_list if op(r[3], 100.31)], op)
 
 
 class TestKey(ZeroBasedTest):
@@ -360,6 +571,94 @@ class TestKey(ZeroBasedTest):
         self.assertEqual(sorted_list[0], ['94894-SM-6632145', 'Austria', 'Blue', 114.51, 2])
         self.assertEqual(sorted_list[-1], ['01335-EJ-3213682', 'France', 'Red', 133.94, 18])
 
+    def test_generated_functions(self):
+        rec = ['David', '52', 127.98]
+
+        self.assertEqual(Key()()(rec), [])
+        self.assertEqual(Key(2, (1, int), 0)()(rec), [127.98, 52, 'David'])
+
+        # the casts are bound to each function, while the compiled code is shared
+        f, g = Key((1, int))(), Key((1, float))()
+
+        self.assertIs(f.__code__, g.__code__)
+        self.assertEqual(f(rec), [52])
+        self.assertEqual(type(g(rec)[0]), float)
+
+    def test_sort_key(self):
+        global input_list
+
+        for k in [Key(0), Key(2, 4, 3), Key((3, str)), FullRecord()]:
+            self.assertEqual(sorted(input_list, key=k.sort_key()), sorted(input_list, key=k()), k.args)
+
+        self.assertEqual(Key(2, 1).sort_key()(['David', '52', 127.98]), (127.98, '52'))
+
+    def test_sort_key_of_overridden_call(self):
+        class Descending(Key):
+            def __call__(self):
+                return lambda rec: [-rec[a] for a in self.args]
+
+        records = [[1, 'z'], [2, 'a'], [1, 'a']]
+
+        self.assertEqual(sorted(records, key=Descending(0).sort_key()), [[2, 'a'], [1, 'z'], [1, 'a']])
+        self.assertEqual(sorted(records, key=FullRecord(0).sort_key()), [[1, 'a'], [1, 'z'], [2, 'a']])
+        self.assertEqual(list(IterReader(records).sort(0)), [[1, 'z'], [1, 'a'], [2, 'a']])
+        self.assertEqual(list(IterReader(records).chain(SortChainable(FullRecord(0)))),
+                         [[1, 'a'], [1, 'z'], [2, 'a']])
+
+    def test_memoized_function(self):
+        rec = ['David', '52', 127.98]
+        k = Key(0, (1, int))
+        f = k()
+
+        self.assertIs(k(), f)
+
+        k.args = (2,)
+
+        self.assertEqual(k.fields, [(2, None)])
+        self.assertEqual(k()(rec), [127.98])
+        self.assertEqual(f(rec), ['David', 52])
+        self.assertIsNot(Key(2)(), k())
+
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_apply_batch_to_array(self):
+        arr = numpy.array([['David', '52', '127.98'], ['Charlie', '10', '3.5']])
+        k = Key(1, (1, int), (2, float))
+        result = k.apply_batch(arr)
+
+        self.assertEqual(result.shape, (2, 3))
+        self.assertEqual(result.tolist(), [['52', '52', '127.98'], ['10', '10', '3.5']])
+        self.assertEqual(Key((0, int)).apply_batch(numpy.array([[1.5, 2.0]])).tolist(), [[1]])
+        self.assertEqual(Key((0, int)).apply_batch(numpy.array([[' 12']])).tolist(), [[12]])
+
+        # values astype() would get wrong go through the cast one at a time
+        self.assertEqual(Key((0, int)).apply_batch(numpy.array([['99999999999999999999']])).tolist(),
+                         [[99999999999999999999]])
+        self.assertRaises(ValueError, Key((0, int)).apply_batch, numpy.array([[1.5], [numpy.nan]]))
+        self.assertEqual(Key((0, str)).apply_batch(numpy.array([[b'a']])).tolist(), [["b'a'"]])
+
+    @unittest.skipUnless(pyarrow, 'requires pyarrow')
+    def test_apply_batch_to_record_batch(self):
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(['David', 'Charlie']), pyarrow.array([' 52', '10']), pyarrow.array([7.5, 7.0])],
+            names=['name', 'age', 'score'])
+        result = Key(2, (1, int), (2, str), (2, int), 0).apply_batch(batch)
+
+        self.assertIsInstance(result, pyarrow.RecordBatch)
+        self.assertEqual(list(batch_rows(result)), [[7.5, 52, '7.5', 7, 'David'], [7.0, 10, '7.0', 7, 'Charlie']])
+
+    @unittest.skipUnless(pyarrow, 'requires pyarrow')
+    def test_apply_batch_casts_like_records(self):
+        columns = [pyarrow.array([True, False]), pyarrow.array([datetime(2020, 1, 2, 3, 4, 5)] * 2),
+                   pyarrow.array(['0x10', '12']), pyarrow.array([1, None])]
+        batch = pyarrow.RecordBatch.from_arrays(columns, names=['a', 'b', 'c', 'd'])
+        rows = list(batch_rows(batch))
+
+        for key in [Key((0, str), (1, str), (0, int)), Key((2, str))]:
+            self.assertEqual(list(batch_rows(key.apply_batch(batch))), list(map(key(), rows)))
+
+        self.assertRaises(ValueError, Key((2, int)).apply_batch, batch)
+        self.assertRaises(TypeError, Key((3, int)).apply_batch, batch)
+
 
 class TestFullRecordKey(ZeroBasedTest):
 
@@ -473,6 +772,15 @@ class TestAbstractChainable(ZeroBasedTest):
         self.assertEqual(len(filtered), 0)
         self.assertEqual(filtered, [])
 
+        # the same pattern is only compiled once
+        self.assertIs(a.grep(r'foo').filter_inst, g.filter_inst)
+
+        g5 = a.grep(r'^FOO', re.IGNORECASE)
+        filtered = list(filter(g5.filter_inst, data))
+
+        self.assertEqual(filtered, ['foobaz'])
+        self.assertIsNot(g5.filter_inst, a.grep(r'^FOO').filter_inst)
+
     def test_transform(self):
         a = AbstractChainable()
         t = a.transform(Reformat)
@@ -569,10 +877,12 @@ class TestIterReader(ZeroBasedTest):
             'Michelle,55,1/31/1967',
             'Mutti,83,8/01/1936'
         ]
-        split_records = map(lambda f: [f.split(',')[0], int(f.split(',')[1]), f.split(',')[2]], records)
+        split_records = map(lambda f: [f[0], int(f[1]), f[2]], (rec.split(',') for rec in records))
         i = IterReader(split_records)
 
-        self.assertEqual(list(i), list(split_records))
+        # split_records is a one-shot iterator, so compare against its values up front
+        self.assertEqual(list(i), [['David', 52, '5/23/1967'], ['Charlie', 10, '6/11/2011'],
+                                   ['Michelle', 55, '1/31/1967'], ['Mutti', 83, '8/01/1936']])
 
     def test_show(self):
         global input_list
@@ -659,6 +969,118 @@ class TestIterReader(ZeroBasedTest):
         self.assertEqual(c3.collector[0][0][0], 'count %s' % len(input_list))
         self.assertEqual(n, i)
 
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_to_numpy(self):
+        global input_list
+
+        i = IterReader(input_list).to_numpy()
+
+        self.assertIsNotNone(i.batches())
+        self.assertEqual(list(i), input_list)
+        self.assertEqual(list(IterReader([]).to_numpy()), [])
+
+        # the steps work on the array and give the same records as on lists
+        s = i.filter(3, gt, 100).sort(2, 4).cut(1, (3, int)).filter(0, is_in, ('Spain', 'Italy'))
+        expected = IterReader(input_list).filter(3, gt, 100).sort(2, 4).cut(1, (3, int)) \
+            .filter(0, is_in, ('Spain', 'Italy'))
+
+        self.assertIsNotNone(s.batches())
+        self.assertEqual(list(s), list(expected))
+        self.assertEqual(list(i.sort(4, reverse=True)), sorted(input_list, key=lambda r: r[4], reverse=True))
+
+        # an explicit dtype converts the values
+        d = IterReader(input_list).to_numpy([('sku', 'U20'), ('country', 'U20'), ('color', 'U10'), ('price', 'f8'),
+                                             ('qty', 'f8')])
+
+        self.assertEqual(list(d.filter(4, gt, 40).cut(4)), [[float(r[4])] for r in input_list if r[4] > 40])
+
+    def test_len_of_generator(self):
+        i = IterReader(rec for rec in input_list)
+
+        self.assertEqual(len(i), len(input_list))
+
+        # the generator has been consumed by len()
+        self.assertEqual(len(i), 0)
+
+    def test_len_of_sized_source(self):
+        class Records(list):
+            def __iter__(self):
+                raise AssertionError('len() iterated over the source')
+
+        self.assertEqual(len(IterReader(Records(input_list))), len(input_list))
+        self.assertEqual(len(IterReader(tuple(input_list))), len(input_list))
+
+    def test_list_runs_chain_once(self):
+        calls = []
+
+        def double(rec):
+            calls.append(rec)
+            return rec * 2
+
+        source = [1, 2, 3]
+        i = IterReader(source).transform(double)
+
+        # list() asks for the length after getting the iterator, and the iterator
+        # gets the records that len() read
+        self.assertEqual(list(i), [2, 4, 6])
+        self.assertEqual(len(calls), 3)
+
+        # len() on its own counts the records without keeping them, so the next
+        # iteration sees a changed source
+        self.assertEqual(len(i), 3)
+        source.append(4)
+
+        self.assertEqual(list(i), [2, 4, 6, 8])
+        self.assertEqual(len(calls), 10)
+
+
+class TestCountingChainable(ZeroBasedTest):
+
+    def test_counting(self):
+        global input_list
+
+        source = IterReader(input_list).filter(2, eq, 'Green')
+        c = source.counting()
+
+        self.assertIsInstance(c, CountingChainable)
+        self.assertEqual(c.parent, source)
+        self.assertIsNone(c.counted)
+
+        records = [rec for rec in c]
+
+        self.assertEqual(c.counted, 10)
+        self.assertEqual(len(c), len(records))
+
+        # a partial iteration doesn't leave a count behind
+        next(iter(c))
+
+        self.assertIsNone(c.counted)
+        self.assertEqual(len(c), 10)
+
+        collector = Collector()
+        c.count(print_function=collector)
+
+        self.assertEqual(collector.collector[0][0][0], 'count 10')
+
+        # after a full pass, count() and len() don't run the chain again
+        calls = []
+
+        def double(rec):
+            calls.append(rec)
+            return rec * 2
+
+        c = IterReader([1, 2, 3]).transform(double).counting()
+
+        self.assertEqual(list(c), [2, 4, 6])
+        self.assertEqual(len(calls), 3)
+
+        collector = Collector()
+        c.count(print_function=collector)
+
+        self.assertEqual(collector.collector[0][0][0], 'count 3')
+        self.assertEqual(len(c), 3)
+        self.assertEqual(len(calls), 3)
+
 
 class TestFileReader(ZeroBasedTest):
 
@@ -675,6 +1097,35 @@ class TestFileReader(ZeroBasedTest):
 
             self.assertEqual(lines, recs)
 
+    def test_small_buffer_size(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write('first line\nsecond line\n\nlast line without newline')
+            fp.flush()
+
+            fr = FileReader(fp.name)
+            fr.buffer_size = 4
+
+            self.assertEqual(list(fr), ['first line', 'second line', '', 'last line without newline'])
+
+    def test_close_on_early_exit(self):
+        class KeepFile(FileReader):
+            def read_headers(self, fp):
+                self.fp = fp
+
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.writelines(['line {}\n'.format(i) for i in range(0, 10)])
+            fp.flush()
+
+            fr = KeepFile(fp.name)
+            records = iter(fr)
+
+            self.assertEqual(next(records), 'line 0')
+            self.assertFalse(fr.fp.closed)
+
+            records.close()
+
+            self.assertTrue(fr.fp.closed)
+
 
 class TestCsvReader(ZeroBasedTest):
 
@@ -696,6 +1147,208 @@ class TestCsvReader(ZeroBasedTest):
 
             self.assertEqual(input_list_str[1:], recs)
 
+    def test_headers(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write('title\nname,age\nDavid,52\nCharlie,10\n')
+            fp.flush()
+
+            cr = CsvReader(fp.name, headers=2)
+
+            self.assertEqual(list(cr), [['David', '52'], ['Charlie', '10']])
+            self.assertEqual(cr.header_records, ['title', 'name,age'])
+
+            # the headers are only kept the first time
+            self.assertEqual(len(cr), 2)
+            self.assertEqual(cr.header_records, ['title', 'name,age'])
+
+    def test_without_decoding(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write('name;age\nDavid;52\r\nCharlie;10\n')
+            fp.flush()
+
+            cr = CsvReader(fp.name, delim=';', decode=False)
+
+            self.assertEqual(list(cr), [[b'David', b'52'], [b'Charlie', b'10']])
+            self.assertEqual(cr.header_records, [b'name;age'])
+            self.assertEqual(list(cr.filter(0, eq, b'David').cut(1)), [[b'52']])
+
+    @unittest.skipIf(sys.version_info < (3,), 'quoted fields require Python 3')
+    def test_quoted_fields(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write('name,address\nDavid,"1 Main St, Springfield"\n"Charlie ""Chuck""",none\n')
+            fp.flush()
+
+            self.assertEqual(list(CsvReader(fp.name, quoted=True)),
+                             [['David', '1 Main St, Springfield'], ['Charlie "Chuck"', 'none']])
+            self.assertEqual(list(CsvReader(fp.name))[0], ['David', '"1 Main St', ' Springfield"'])
+            self.assertRaises(RuntimeError, CsvReader, fp.name, decode=False, quoted=True)
+            self.assertRaises(RuntimeError, CsvReader, fp.name, delim='||', quoted=True)
+
+    @unittest.skipIf(sys.version_info < (3,), 'quoted fields require Python 3')
+    def test_quoted_line_endings(self):
+        with tempfile.NamedTemporaryFile(mode='wb') as fp:
+            fp.write(b'name,note\r\nDavid,"two\r\nlines"\r\nCharlie,one\r\n')
+            fp.flush()
+
+            c = CsvReader(fp.name, quoted=True)
+
+            self.assertEqual(list(c), [['David', 'two\r\nlines'], ['Charlie', 'one']])
+            self.assertEqual(c.header_records, ['name,note'])
+
+
+@unittest.skipUnless(pyarrow, 'requires pyarrow')
+class TestArrowCsvReader(ZeroBasedTest):
+
+    def write_input_list(self, fp):
+        global input_list
+
+        fp.write('sku,country,color,price,qty\n')
+        fp.writelines([','.join(map(str, rec)) + '\n' for rec in input_list])
+        fp.flush()
+
+    def test_pyarrow_imported_when_needed(self):
+        code = 'import sys, coreutils; print("pyarrow" in sys.modules)'
+
+        self.assertEqual(subprocess.check_output([sys.executable, '-c', code]).strip(), b'False')
+
+    def test_same_records_as_csv_reader(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            self.write_input_list(fp)
+
+            ar = ArrowCsvReader(fp.name)
+
+            self.assertEqual(list(ar), list(CsvReader(fp.name)))
+            self.assertEqual(ar.header_records, ['sku,country,color,price,qty'])
+
+    def test_quotes_kept(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write('name,age\n"David",52\nCharlie,"10"\n')
+            fp.flush()
+
+            self.assertEqual(list(ArrowCsvReader(fp.name)), [['"David"', '52'], ['Charlie', '"10"']])
+            self.assertEqual(list(ArrowCsvReader(fp.name)), list(CsvReader(fp.name)))
+
+    def test_multi_character_delimiter(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write('name::age\nDavid::52\n')
+            fp.flush()
+
+            ar = ArrowCsvReader(fp.name, delim='::')
+
+            self.assertIsNone(ar.batches())
+            self.assertEqual(list(ar), [['David', '52']])
+
+            # the line parser reads through the buffer of FileReader, not pyarrow's block
+            self.assertEqual(ar.buffer_size, FileReader.buffer_size)
+            self.assertNotEqual(ar.block_size, ar.buffer_size)
+
+    def test_batches(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            self.write_input_list(fp)
+
+            ar = ArrowCsvReader(fp.name)
+            batches = list(ar.batches())
+
+            self.assertEqual(sum(b.num_rows for b in batches), len(input_list))
+            self.assertIsInstance(batches[0], pyarrow.RecordBatch)
+
+    def test_infer_types(self):
+        global input_list
+
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            self.write_input_list(fp)
+
+            ar = ArrowCsvReader(fp.name, infer_types=True)
+
+            self.assertEqual(list(ar), input_list)
+
+    def test_filter_batches(self):
+        global input_list
+
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            self.write_input_list(fp)
+
+            ar = ArrowCsvReader(fp.name, infer_types=True)
+            expected = [rec for rec in input_list if rec[3] > 100 and rec[2] == 'Blue']
+            f = ar.filter(3, gt, 100).filter(2, eq, 'Blue')
+
+            self.assertIsNotNone(f.batches())
+            self.assertEqual(list(f), expected)
+
+            # a value of a different type falls back to evaluating each record
+            self.assertEqual(list(ar.filter(3, eq, '95.05')), [])
+
+            # plain functions are always evaluated record by record
+            self.assertEqual(len(ar.filter(1, eq, 'Spain').chain(FilterChainable(lambda r: r[4] > 20))), 2)
+
+    def test_sort_batches(self):
+        global input_list
+
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            self.write_input_list(fp)
+
+            ar = ArrowCsvReader(fp.name, infer_types=True)
+
+            for sort_params, reverse in [((2, 3), False), ((1, 4), True), ((), False)]:
+                s = ar.sort(*sort_params, reverse=reverse)
+
+                self.assertIsNotNone(s.batches())
+                self.assertEqual(list(s), list(IterReader(input_list).sort(*sort_params, reverse=reverse)))
+
+            self.assertIsNone(ar.sort((3, str)).batches())
+
+    def test_cut_batches(self):
+        global input_list
+
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            self.write_input_list(fp)
+
+            ar = ArrowCsvReader(fp.name, infer_types=True)
+            c = ar.filter(2, eq, 'Green').cut(4, 1, (3, int))
+
+            self.assertIsNotNone(c.batches())
+            self.assertEqual(list(c), list(IterReader(input_list).filter(2, eq, 'Green').cut(4, 1, (3, int))))
+
+            # other transforms go back to records
+            t = c.transform(lambda r: r[0])
+
+            self.assertIsNone(t.batches())
+            self.assertEqual(list(t), [rec[4] for rec in input_list if rec[2] == 'Green'])
+
+    def test_batches_through_the_chain(self):
+        global input_list
+
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            self.write_input_list(fp)
+
+            ar = ArrowCsvReader(fp.name, infer_types=True)
+            s = ar.filter(3, gt, 100).cut(1, 3).sort(0, 1).filter(1, lt, 130)
+            expected = IterReader(input_list).filter(3, gt, 100).cut(1, 3).sort(0, 1).filter(1, lt, 130)
+
+            for step in [s, s.parent, s.parent.parent, s.parent.parent.parent]:
+                self.assertIsInstance(step, BatchChainable)
+                self.assertIsNotNone(step.batches())
+
+            self.assertEqual(list(s), list(expected))
+
+            # after a step that only works on records, later steps do the same
+            r = ar.transform(lambda rec: rec[1:]).sort(0).filter(0, ne, 'Spain')
+
+            self.assertIsNone(r.batches())
+            self.assertIsNone(r.parent.batches())
+            self.assertEqual(list(r), [rec[1:] for rec in sorted(input_list, key=lambda rec: rec[1])
+                                       if rec[1] != 'Spain'])
+
+    def test_empty_file(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write('header\n')
+            fp.flush()
+
+            ar = ArrowCsvReader(fp.name, infer_types=True)
+
+            self.assertEqual(list(ar), [])
+            self.assertEqual(ar.header_records, ['header'])
+
 
 class TestSortChainable(ZeroBasedTest):
 
@@ -744,6 +1397,56 @@ class TestSortChainable(ZeroBasedTest):
         self.assertEqual(s_list[0], first)
         self.assertEqual(s_list[-1], last)
 
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_sort_with_argsort(self):
+        global input_list
+
+        for sort_params, reverse in [((2, 3), False), ((2, 3), True), ((1, 4), True), ((), False), ((), True)]:
+            expected = list(IterReader(input_list).sort(*sort_params, reverse=reverse))
+            s = IterReader(input_list).sort(*sort_params, reverse=reverse)
+            s.argsort_min_size = 0
+
+            self.assertEqual(list(s), expected, sort_params)
+
+        # ties keep their original order, just like sorted()
+        s = IterReader(input_list).sort(2, reverse=True)
+        s.argsort_min_size = 0
+
+        self.assertEqual(list(s), sorted(input_list, key=lambda r: r[2], reverse=True))
+
+        # mixed types and casts are left to sorted()
+        data = [[1], ['a'], [2.5]] * 3
+        s = IterReader(data).sort(0, reverse=True)
+        s.argsort_min_size = 0
+
+        self.assertRaises(TypeError, list, s)
+
+        s = IterReader(input_list).sort((4, str))
+        s.argsort_min_size = 0
+
+        self.assertEqual(list(s), sorted(input_list, key=lambda r: str(r[4])))
+
+        # a long str would make NumPy store every value of the column at its width
+        data = [['x' * (n % 3)] for n in range(0, 100)] + [['y' * 100000]]
+        s = IterReader(data).sort(0)
+        s.argsort_min_size = 0
+
+        self.assertIsNone(coreutils._argsort(data, [0], False))
+        self.assertEqual(list(s), sorted(data))
+
+    def test_sort_with_overridden_key_call(self):
+        class Descending(Key):
+            def __call__(self):
+                return lambda rec: [-rec[a] for a in self.args]
+
+        records = [[n % 50, 'a'] for n in range(0, 200)]
+        s = IterReader(records).chain(SortChainable(Descending(0)))
+        s.argsort_min_size = 0
+
+        self.assertIsNone(s.key_indices())
+        self.assertEqual(list(s)[0], [49, 'a'])
+        self.assertEqual(SortChainable(FullRecord()).key_indices(), [])
+
 
 class TestFilterChainable(ZeroBasedTest):
 
@@ -779,6 +1482,72 @@ class TestFilterChainable(ZeroBasedTest):
 
         self.assertEqual(list(IterReader(data).grep(r'9.*2.*sed')), ['09/02/2019 sed do eiusmod tempor incididunt'])
 
+    @unittest.skipIf(sys.version_info < (3,), 'Python 2 cannot pickle the bound search method')
+    def test_pickled_grep(self):
+        data = ['Lorem ipsum', 'dolor sit amet', 'magna aliqua']
+
+        i = pickle.loads(pickle.dumps(IterReader(data).grep('or')))
+
+        self.assertEqual(list(i), ['Lorem ipsum', 'dolor sit amet'])
+
+    def check_grep_engine(self, engine):
+        data = [
+            '08/31/2019 Lorem ipsum dolor sit amet',
+            '09/01/2019 consectetur adipiscing elit',
+            '09/02/2019 sed do eiusmod tempor incididunt',
+            '09/03/2019 ut labore et dolore magna aliqua'
+        ]
+
+        for regex, flags in [('ore', 0), (r'9.*2.*sed', 0), (r'^09/0[13]', 0), ('^LOREM', 0),
+                             ('lorem', re.IGNORECASE), (r'elit$', 0), ('', 0)]:
+            expected = list(IterReader(data).grep(regex, flags))
+
+            self.assertEqual(list(IterReader(data).grep(regex, flags, engine=engine)), expected, regex)
+
+        self.assertRaisesRegex(RuntimeError, 'only re.IGNORECASE', IterReader(data).grep, 'ore', re.VERBOSE, engine)
+
+        # bytes records with a bytes regex and flags
+        self.assertEqual(list(IterReader([b'MORE data', b'less']).grep(b'more', re.IGNORECASE, engine=engine)),
+                         [b'MORE data'])
+
+    @unittest.skipUnless(re2, 'requires google-re2')
+    def test_grep_re2(self):
+        self.check_grep_engine('re2')
+
+    @unittest.skipUnless(hyperscan, 'requires hyperscan')
+    def test_grep_hyperscan(self):
+        self.check_grep_engine('hyperscan')
+
+    @unittest.skipUnless(hyperscan, 'requires hyperscan')
+    def test_grep_hyperscan_fused(self):
+        data = ['08/31/2019 Lorem ipsum dolor sit amet', '09/01/2019 consectetur adipiscing elit',
+                '09/02/2019 sed do eiusmod tempor incididunt', '09/03/2019 ut labore et dolore magna aliqua']
+
+        i = (IterReader(data).grep('^09', engine='hyperscan')
+             .grep('or', engine='hyperscan')
+             .grep('sed', engine='hyperscan'))
+
+        # the three greps scan each record once with a single database
+        self.assertEqual([kind for kind, func in i._compile_plan()[1]], ['filter'])
+        self.assertEqual(list(i), ['09/02/2019 sed do eiusmod tempor incididunt'])
+
+    def test_grep_auto_engine(self):
+        data = ['08/31/2019 Lorem ipsum dolor sit amet', '09/01/2019 consectetur adipiscing elit']
+
+        # a backreference or a flag the other engines don't support falls back to re
+        for regex, flags in [('ore', 0), (r'(or).*\1', 0), ('l o r e m', re.VERBOSE | re.IGNORECASE),
+                             (r'^0[89]/(01|31)', 0), (r'[^a-z]\.?2{2,}', 0)]:
+            expected = list(IterReader(data).grep(regex, flags))
+
+            self.assertEqual(list(IterReader(data).grep(regex, flags, engine='auto')), expected, regex)
+
+        # syntax the engines read differently is always left to re
+        for regex, data in [('a{,3}$', ['aaa', 'a{,3}', 'x']), ('c$', ['abc\n']), (r'\d', ['\u0663'])]:
+            self.assertEqual(list(IterReader(data).grep(regex, engine='auto')), list(IterReader(data).grep(regex)))
+
+    def test_grep_unknown_engine(self):
+        self.assertRaisesRegex(RuntimeError, "unknown regex engine 'sed'", IterReader([]).grep, 'ore', 0, 'sed')
+
     def test_exception(self):
         global input_list
 
@@ -800,6 +1569,94 @@ class TestFilterChainable(ZeroBasedTest):
         self.assertEqual(s_list[0], expected)
 
 
+class TestFusedChains(ZeroBasedTest):
+
+    def test_compile_plan(self):
+        global input_list
+
+        source = IterReader(input_list).sort(0)
+        i = source.filter(2, eq, 'Blue').cut(1, 4).transform(lambda r: [r[0], r[1] * 2]).filter(1, gt, 10)
+        plan_source, stages = i._compile_plan()
+
+        self.assertIs(plan_source, source)
+        self.assertEqual([kind for kind, func in stages], ['scan', 'map', 'map', 'scan'])
+
+        expected = [[r[1], r[4] * 2] for r in sorted(input_list) if r[2] == 'Blue' and r[4] * 2 > 10]
+
+        self.assertEqual(list(i), expected)
+
+    def test_overridden_iter(self):
+        class Doubled(TransformChainable):
+            def __init__(self):
+                super(Doubled, self).__init__(None)
+
+            def __iter__(self):
+                return ([v * 2 for v in rec] for rec in self.parent)
+
+        read = []
+
+        class Logged(FilterChainable):
+            def iter_records(self):
+                for rec in super(Logged, self).iter_records():
+                    read.append(rec)
+                    yield rec
+
+        i = IterReader([[1], [2], [3]]).chain(Doubled()).filter(0, gt, 2)
+
+        self.assertEqual(list(i), [[4], [6]])
+
+        i = IterReader([[1], [2], [3]]).chain(Logged(Cond(0, gt, 1))).filter(0, lt, 3)
+
+        self.assertIs(i._compile_plan()[0], i.parent)
+        self.assertEqual(list(i), [[2]])
+        self.assertEqual(read, [[2], [3]])
+
+    def test_transform_before_filter(self):
+        global input_list
+
+        # a filter after a transform sees the transformed records
+        i = IterReader(input_list).cut(4).filter(0, eq, 2)
+
+        self.assertEqual(list(i), [[2], [2]])
+
+    def test_consecutive_conds(self):
+        global input_list
+
+        i = IterReader(input_list).filter(3, gt, 100).filter(1, ne, 'Spain') \
+            .chain(FilterChainable(lambda r: r[0] < '9')).filter(4, lte, 10).filter(2, eq, 'Blue')
+        plan_source, stages = i._compile_plan()
+
+        # the first two conditions and the last two are each evaluated by one function
+        self.assertEqual(len(stages), 3)
+        self.assertEqual(list(i), [r for r in input_list if r[3] > 100 and r[1] != 'Spain' and r[2] == 'Blue'
+                                   and r[4] <= 10 and r[0] < '9'])
+
+        # a record failing an earlier condition is never tested by the later ones
+        self.assertEqual(list(IterReader([[None, 1], [2, 2]]).filter(1, eq, 2).filter(0, eq, 2)), [[2, 2]])
+        self.assertRaisesRegex(RuntimeError, 'Attempt to return None from rec',
+                               list, IterReader([[None, 2]]).filter(1, eq, 2).filter(0, eq, 2))
+
+    def test_contradictory_conds(self):
+        global input_list
+
+        class NoRecords(IterReader):
+            def __iter__(self):
+                raise AssertionError('should not be read')
+
+        self.assertEqual(list(NoRecords(input_list).filter(1, eq, 'Spain').filter(1, eq, 'Italy')), [])
+        self.assertEqual(list(NoRecords(input_list).filter(1, is_in, ['Spain', 'Italy']).filter(1, eq, 'Malta')), [])
+
+        # equal values, values of different kinds and other fields don't contradict
+        records = input_list + [['x', 2, 'Blue', 0, 2]]
+        self.assertEqual(list(IterReader(records).filter(4, eq, 2).filter(4, eq, 2.0)),
+                         [r for r in records if r[4] == 2])
+        self.assertEqual(list(IterReader(records).filter(1, eq, 'Spain').filter(1, eq, 2)), [])
+        self.assertEqual(list(IterReader(records).filter(1, eq, 'Spain').filter(2, eq, 'Blue')),
+                         [r for r in records if r[1] == 'Spain' and r[2] == 'Blue'])
+        self.assertEqual(list(IterReader(records).filter(1, is_in, ['Spain', 2]).filter(1, eq, 'Spain')),
+                         [r for r in records if r[1] == 'Spain'])
+
+
 class TeestTransformChainable(ZeroBasedTest):
 
     def test_noop_transform(self):
@@ -809,6 +1666,20 @@ class TeestTransformChainable(ZeroBasedTest):
 
         self.assertEqual(list(i), input_list)
 
+        # a Reformat that doesn't override transform() is left out of the plan, but
+        # is still instantiated for every iteration
+        created = []
+
+        class Noop(Reformat):
+            def __init__(self):
+                created.append(self)
+
+        i = IterReader(input_list).filter(1, eq, 'Spain').transform(Noop).filter(4, gt, 20)
+
+        for n in range(1, 3):
+            self.assertEqual(list(i), [r for r in input_list if r[1] == 'Spain' and r[4] > 20])
+            self.assertEqual(len(created), n)
+
     def test_real_transform(self):
         global input_list
 
@@ -823,6 +1694,29 @@ class TeestTransformChainable(ZeroBasedTest):
         self.assertEqual(t_list[0][1], 'Green')
         self.assertEqual(t_list[0][2], 95.05)
 
+    def test_csv_split_reformat(self):
+        records = ['David,52,5/23/1967', 'Charlie,10,6/11/2011']
+
+        self.assertEqual(list(IterReader(records).transform(CsvSplitReformat)),
+                         [['David', '52', '5/23/1967'], ['Charlie', '10', '6/11/2011']])
+
+        class AgeReformat(CsvSplitReformat):
+            delim = '|'
+
+            def transform(self, in_rec):
+                name, age, born = super(AgeReformat, self).transform(in_rec)
+                return [name, int(age), born]
+
+        self.assertEqual(list(IterReader([r.replace(',', '|') for r in records]).transform(AgeReformat)),
+                         [['David', 52, '5/23/1967'], ['Charlie', 10, '6/11/2011']])
+
+    def test_pickled_transform(self):
+        records = ['David,52,5/23/1967', 'Charlie,10,6/11/2011']
+
+        i = pickle.loads(pickle.dumps(IterReader(records).transform(CsvSplitReformat)))
+
+        self.assertEqual(list(i), [['David', '52', '5/23/1967'], ['Charlie', '10', '6/11/2011']])
+
     def test_transform_with_lambda(self):
         global input_list
 
@@ -847,6 +1741,27 @@ class TeestTransformChainable(ZeroBasedTest):
         self.assertEqual(r[3], 7)
         self.assertEqual(r[4], 95.05)
 
+    def test_transform_with_other_callables(self):
+        global input_list
+
+        class Doubler(object):
+            def __init__(self, field):
+                self.field = field
+
+            def __call__(self, rec):
+                return rec[self.field] * 2
+
+            def double(self, rec):
+                return rec[self.field] * 2
+
+        expected = [rec[4] * 2 for rec in input_list]
+
+        self.assertEqual(list(IterReader(input_list).transform(Doubler(4))), expected)
+        self.assertEqual(list(IterReader(input_list).transform(Doubler(4).double)), expected)
+        self.assertEqual(list(IterReader(input_list).transform(functools.partial(operator.mul, 2))),
+                         [rec * 2 for rec in input_list])
+        self.assertEqual(list(IterReader(input_list).transform(Key(4, 1)())), [[r[4], r[1]] for r in input_list])
+
     def test_transform_exception(self):
         global input_list
 
@@ -889,6 +1804,152 @@ class TestReduceChainable(ZeroBasedTest):
         self.assertEqual(len(i.filter(2, eq, 2)), 3)
         self.assertEqual(len(i.filter(2, eq, 3)), 1)
 
+    def test_sort_then_uniq(self):
+        compared = []
+
+        class Value(str):
+            def __lt__(self, other):
+                compared.append(self)
+                return str.__lt__(self, other)
+
+        # a sort by the same key only groups the records, so only the distinct keys
+        # are sorted, with the same result as sorting all of the records
+        for reducer, fields in [(Uniq, (1,)), (UniqCount, (1, 2)), (UniqCount, ((4, str),))]:
+            expected = list(IterReader(input_list).sort(*fields).counting().reduce(reducer, *fields))
+
+            self.assertEqual(list(IterReader(input_list).sort(*fields).reduce(reducer, *fields)), expected)
+
+        self.assertEqual(list(IterReader([[Value('a')]] * 100).sort(0).reduce(UniqCount, 0)), [[['a'], 'count', 100]])
+        self.assertEqual(compared, [])
+
+        self.assertEqual(list(IterReader([]).sort(0).reduce(Uniq, 0)), [None])
+        self.assertEqual(list(IterReader([]).sort(0).reduce(UniqCount, 0)), [[None, 'count', 0]])
+
+        # keys that can't be hashed are sorted instead
+        records = [[['a']], [['b']], [['a']]]
+
+        self.assertEqual(list(IterReader(records).sort(0).reduce(UniqCount, 0)),
+                         [[[['a']], 'count', 2], [[['b']], 'count', 1]])
+        self.assertEqual(list(IterReader(records).sort(0).reduce(Uniq, 0)), [[['a']], [['b']]])
+
+    def test_uniq_count_same_as_reducer(self):
+        global input_list
+
+        # a subclass doesn't take the fast path for UniqCount
+        class SlowUniqCount(UniqCount):
+            pass
+
+        # includes unsorted input and no input at all, which the reducer handles its own way
+        for records, field in [(sorted(input_list, key=lambda r: r[1]), 1), (input_list, 1), ([], 0),
+                               ([['b'], ['a'], ['b'], ['c']], 0)]:
+            expected = list(IterReader(records).reduce(SlowUniqCount, field))
+
+            self.assertEqual(list(IterReader(records).reduce(UniqCount, field)), expected)
+
+
+class TestHashReduceChainable(ZeroBasedTest):
+
+    def test_reduce_with_uniq(self):
+        global input_list
+
+        r = IterReader(input_list).cut(1).reduce(Uniq, 0, presorted=False)
+
+        self.assertIsInstance(r, HashReduceChainable)
+        self.assertEqual(list(r), [[c] for c in
+                                   ['Georgia', 'France', 'Italy', 'Spain', 'Austria', 'Turkey', 'Germany', 'Ireland',
+                                    'Poland', 'Sweden', 'Norway', 'Malta', 'Montenegro']])
+
+    def test_reduce_with_uniq_count(self):
+        global input_list
+
+        r = IterReader(input_list).reduce(UniqCount, 1, 2, presorted=False)
+        expected = IterReader(input_list).cut(1, 2).sort(0, 1).reduce(UniqCount, 0, 1)
+
+        self.assertEqual(sorted(r), list(expected))
+
+    def test_reduce_with_custom_reducer(self):
+        global input_list
+
+        class Total(AbstractReducer):
+            def initialize(self, key):
+                self.total = 0
+
+            def reduce(self, key, in_rec):
+                self.total += in_rec[4]
+
+            def output(self, key, prev_rec):
+                return key + [self.total, prev_rec[0]]
+
+        r = {rec[0]: rec[1:] for rec in IterReader(input_list).reduce(Total, 1, presorted=False)}
+
+        self.assertEqual(r['Spain'], [2 + 23 + 25 + 19, '19017-HN-3601064'])
+        self.assertEqual(r['Malta'], [6, '03935-SA-5929589'])
+        self.assertEqual(sum(v[0] for v in r.values()), sum(rec[4] for rec in input_list))
+
+    def test_empty(self):
+        self.assertEqual(list(IterReader([]).reduce(UniqCount, 0, presorted=False)), [])
+        self.assertEqual(list(IterReader([]).reduce(Uniq, 0, presorted=False)), [])
+
+    def test_unexpected_keyword(self):
+        self.assertRaisesRegex(TypeError, "unexpected keyword argument 'presort'",
+                               IterReader([]).reduce, Uniq, 0, presort=False)
+
+
+# pipeline factories for run_parallel() have to be top level functions
+
+def spain_from_file(filename):
+    return CsvReader(filename, headers=True).filter(1, eq, 'Spain').cut(0)
+
+
+def sorted_skus(records):
+    return IterReader(records).cut(0).sort()
+
+
+class TestRunParallel(ZeroBasedTest):
+
+    def test_parallel_batches(self):
+        global input_list
+
+        batches = IterReader(input_list).parallel_batches(4)
+
+        self.assertEqual(len(batches), 4)
+        self.assertEqual(flatten(batches), input_list)
+        self.assertEqual(IterReader([1, 2]).parallel_batches(3), [[1], [2], []])
+        self.assertRaises(ValueError, IterReader([1, 2]).parallel_batches, 0)
+
+    @unittest.skipUnless(futures, 'requires concurrent.futures')
+    def test_run_parallel_over_files(self):
+        global input_list
+        files = []
+
+        try:
+            for i in range(3):
+                fp = tempfile.NamedTemporaryFile(mode='w')
+                fp.write('sku,country,color,price,qty\n')
+                fp.writelines([','.join(map(str, rec)) + '\n' for rec in input_list[i::3]])
+                fp.flush()
+                files.append(fp)
+
+            results = run_parallel(spain_from_file, [fp.name for fp in files], workers=2)
+        finally:
+            for fp in files:
+                fp.close()
+
+        self.assertEqual(results, [[[rec[0]] for rec in input_list[i::3] if rec[1] == 'Spain'] for i in range(3)])
+
+    @unittest.skipUnless(futures, 'requires concurrent.futures')
+    def test_run_parallel_over_batches(self):
+        global input_list
+
+        results = run_parallel(sorted_skus, IterReader(input_list).parallel_batches(2))
+
+        self.assertEqual(results, [sorted([rec[0]] for rec in batch)
+                                   for batch in IterReader(input_list).parallel_batches(2)])
+
+    @unittest.skipUnless(futures and sys.version_info < (3, 7), 'requires concurrent.futures before Python 3.7')
+    def test_start_method_before_3_7(self):
+        self.assertRaisesRegex(RuntimeError, 'from Python 3.7', run_parallel, sorted_skus, [[]], start_method='spawn')
+
 
 class TestMoreOneBasedChains(OneBasedTest):
 